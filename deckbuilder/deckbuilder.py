@@ -16,6 +16,7 @@ from .hider import Hider
 from .tts import get_speech
 from .sentences import SentenceSelector
 from spanish_tools.sentences import SpanishSentences
+from spanish_tools.freq import FreqDB
 
 from collections import defaultdict
 
@@ -1419,8 +1420,16 @@ class DeckBuilder():
                 else:
                     raise ValueError(f'Unknown option "{option}" specified in wordlist {wordlist}')
 
+            print("loading", filename, all_allowed_flags, limit, metadata, minuse)
+
+            # Lists written by make_freq --sqlite are filtered by flag in the database
+            if FreqDB.is_freq_db(filename):
+                freq_db = FreqDB(filename)
+                self.load_wordlist_rows(freq_db.iter_rows(all_allowed_flags, limit), all_allowed_flags, limit, metadata, minuse)
+                freq_db.close()
+                continue
+
             with open(filename, newline="") as csvfile:
-                print("loading", filename, all_allowed_flags, limit, metadata, minuse)
                 self.load_wordlist(csvfile, all_allowed_flags, limit, metadata, minuse)
 
 
@@ -1470,8 +1479,13 @@ class DeckBuilder():
             if reqfield not in csvreader.fieldnames:
                 raise ValueError(f"No '{reqfield}' field specified in wordlist")
 
+        self.load_wordlist_rows(csvreader, allowed_flags, limit, metadata, minuse)
+
+    def load_wordlist_rows(self, rows, allowed_flags, limit=0, metadata=None, minuse=0):
+        # rows is an iterator that provides dicts with "spanish", "pos" and optionally "count", "flags" and "position"
+
         count = 0
-        for row in csvreader:
+        for row in rows:
             if not row:
                 continue
 
@@ -1,2 +1,8 @@
-from .freq import FrequencyList
+from .freq import FrequencyList, init_worker
+from .lemma_cache import LemmaCache
 from .ngram_prob import NgramPosProbability
+from .resolved_lines import ResolvedLines
+from .phase_timer import PhaseTimer
+from .irregular_verbs import IrregularVerbs
+from .pos_ranks import PosRanks
+from .freq_db import FreqDB
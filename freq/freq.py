@@ -1,31 +1,169 @@
 #!/usr/bin/python3
 
 import argparse
+import hashlib
+import heapq
+import json
 import os
 import re
 import sys
 
+from array import array
 from collections import defaultdict, namedtuple
 
 from enwiktionary_wordlist.wordlist import Wordlist
 from enwiktionary_wordlist.word import Word
 from enwiktionary_wordlist.all_forms import AllForms
 
+from .irregular_verbs import IrregularVerbs
+from .lru_cache import LRUCache
+
 Entry = namedtuple("Entry", [ "pos", "count", "lemma" ])
 
+class LemmaUsage():
+    """ Total count of a lemma/pos and the count of each form that contributed to it, as parallel arrays """
+
+    __slots__ = ("count", "counts", "forms")
+
+    def __init__(self):
+        self.count = 0
+        self.counts = array("q")
+        self.forms = []
+
+    def add(self, count, form):
+        self.count += count
+        self.counts.append(count)
+        self.forms.append(form)
+
+    def sort(self):
+        """ Sorts the forms by count, descending, keeping the original order of forms with the same count """
+        order = sorted(range(len(self.forms)), key=self.counts.__getitem__, reverse=True)
+        self.counts = array("q", [self.counts[i] for i in order])
+        self.forms = [self.forms[i] for i in order]
+
+    def __len__(self):
+        return len(self.forms)
+
+    def __str__(self):
+        """ Returns the usage formatted as "count:form|count:form", sorted by count """
+        order = sorted(range(len(self.forms)), key=self.counts.__getitem__, reverse=True)
+        return "|".join(f"{self.counts[i]}:{self.forms[i]}" for i in order)
+
+class FreqItem():
+    """ A row of the lemma list built by FrequencyList.build_freqlist """
+
+    __slots__ = ("count", "word", "pos", "flags", "usage")
+
+    def __init__(self, count, word, pos, flags, usage):
+        self.count = count
+        self.word = word
+        self.pos = pos
+        self.flags = flags
+        self.usage = usage
+
+# FrequencyList used by worker processes, see init_worker()
+_worker_flist = None
+
+def init_worker(factory, *args):
+    """
+    multiprocessing.Pool initializer for FrequencyList.find_lemmas(pool=)
+    factory(*args) must return a FrequencyList, it is called once in each worker process
+    """
+    global _worker_flist
+    _worker_flist = factory(*args)
+
+def resolve_batch(batch):
+    res = [_worker_flist.export_resolved(_worker_flist.resolve_line(linenum, line)) for linenum, line in batch]
+    return res, _worker_flist.pop_worker_state()
+
+def irregular_batch(verbs):
+    res = [(verb, _worker_flist.get_verb_irregularities(verb)) for verb in verbs]
+    return res, _worker_flist.pop_worker_state()
+
 class FrequencyList():
 
-    def __init__(self, wordlist, allforms, ngprobs, ignore_data=[], debug_word=None):
+    # Bit flags stored in lemma_flags, see get_lemma_flags()
+    FLAG_LEMMA = 1
+    FLAG_RARE = 2
+    FLAG_PRIMARY = 4
+    FLAG_FORMTYPE_FIRST_SENSE = 8
+
+    def __init__(self, wordlist, allforms, ngprobs, ignore_data=[], debug_word=None, lemma_cache=None, memo_size=0,
+            form_of_diagnostics=False, trace_file=None, irregular_verbs=None, pos_ranks=None):
         self.wordlist = wordlist
         self.allforms = allforms
         self.ngprobs = ngprobs
         self.load_ignore(ignore_data)
         self.DEBUG_WORD = debug_word
-        self.forced_regs = {}
+        # debug_word may be a single word or a list of words to trace
+        self.debug_words = {debug_word} if isinstance(debug_word, str) else set(debug_word or [])
+        self.trace_file = trace_file
+        self.trace_count = 0
+        self.profiler = None
+        self.irregular_verbs = irregular_verbs if irregular_verbs is not None else IrregularVerbs()
+        self.pos_ranks = pos_ranks
+        self.lemma_cache = lemma_cache
+        self.lemma_memo = LRUCache(memo_size) if memo_size else None
+        self.lemma_flags = {}
+        self.form_of_closure = {}
+        # When enabled, problems in form-of chains are collected here instead of printed as they're resolved
+        self.form_of_problems = [] if form_of_diagnostics else None
+
+    # Methods timed by enable_profiling(), each one is reported as a separate phase
+    PROFILE_PHASES = [
+        "find_lemmas",
+        "resolve_line",
+        "get_preferred_lemmas",
+        "get_best_pos",
+        "get_most_frequent_lemma",
+        "resolve_plurals",
+        "get_best_singular",
+        "build_freqlist",
+        "filter_names",
+        "get_flags",
+        "index_irregular_verbs",
+        "get_word_irregularities",
+        "is_irregular_form",
+    ]
+
+    def enable_profiling(self, profiler):
+        """
+        Records the time spent in each phase of process() and formtypes() in profiler (a PhaseTimer)
+        along with the number of forms routed to multi_lemmas and maybe_plurals
+        Lines resolved by pool workers are not included in the resolve_line phase
+        """
+        self.profiler = profiler
+        profiler.wrap(self.ngprobs, "get_preferred_case", "case_normalization")
+        for method in self.PROFILE_PHASES:
+            profiler.wrap(self, method)
 
     def debug(self, form, *args):
-        if form == self.DEBUG_WORD:
+        """
+        Traces args if form is one of the debug words
+        Call sites that build their arguments should check "if form in self.debug_words"
+        first so that nothing is evaluated when tracing is disabled
+        """
+        if form in self.debug_words:
+            self.trace(form, *args)
+
+    def trace(self, form, *args):
+        """
+        Writes a trace event for form to trace_file as a line of JSON,
+        or to stderr if no trace file was specified
+        """
+        self.trace_count += 1
+        if not self.trace_file:
             print("#", form, *args, file=sys.stderr)
+            return
+
+        event = {
+            "seq": self.trace_count,
+            "form": form,
+            "caller": sys._getframe(2).f_code.co_name,
+            "args": [arg if isinstance(arg, (str, int, float, type(None))) else repr(arg) for arg in args],
+        }
+        self.trace_file.write(json.dumps(event, ensure_ascii=False))
+        self.trace_file.write("\n")
 
     def load_ignore(self, ignore_data):
         self.ignore = {line.strip() for line in ignore_data if line.strip() and not line.strip().startswith("#")}
@@ -34,27 +172,68 @@ class FrequencyList():
         if word.pos != "v":
             return False
 
-        forced_reg = self.forced_regs.get(word)
-        if forced_reg is None:
-            forced_reg = Word(word.word, [ ("pos", word.pos), ("meta", re.sub("es-conj", "es-conj-reg", word.meta)) ])
-            self.forced_regs[word] = forced_reg
-
-        return word.forms != forced_reg.forms
+        irregular, irregular_forms = self.get_word_irregularities(word)
+        return irregular
 
     def is_irregular_form(self, form, formtype, word):
+        """ Returns True if form, one of the word's forms of the given formtype, isn't a regular form """
         if word.pos != "v":
             return False
 
-        forced_reg = self.forced_regs.get(word)
-        if forced_reg is None:
-            forced_reg = Word(word.word, [ ("pos", word.pos), ("meta", re.sub("es-conj", "es-conj-reg", word.meta)) ])
-            self.forced_regs[word] = forced_reg
+        irregular, irregular_forms = self.get_word_irregularities(word)
+        return (formtype, form) in irregular_forms
+
+    def get_word_irregularities(self, word):
+        """ Returns (irregular, irregular_forms) for a verb Word, see IrregularVerbs """
+
+        index = self.get_word_index(word)
+        if index is None:
+            return self.compute_irregularities(word)
+
+        return self.get_verb_irregularities(word.word)[index]
+
+    def get_verb_irregularities(self, verb):
+        """ Returns the IrregularVerbs items for verb, computing and storing them if needed """
+
+        items = self.irregular_verbs.get(verb)
+        if items is None:
+            items = [self.compute_irregularities(w) for w in self.wordlist.get_iwords(verb, "v")]
+            self.irregular_verbs.set(verb, items)
+        return items
+
+    def compute_irregularities(self, word):
+        """ Returns (irregular, irregular_forms) by comparing the word's forms to a forced regular conjugation """
+
+        forced_reg = Word(word.word, [ ("pos", word.pos), ("meta", re.sub("es-conj", "es-conj-reg", word.meta)) ])
+        irregular_forms = frozenset((formtype, form) for formtype, forms in word.forms.items()
+                for form in forms if form not in forced_reg.forms.get(formtype, []))
+        return word.forms != forced_reg.forms, irregular_forms
+
+    def index_irregular_verbs(self, verbs, pool=None, batch_size=100):
+        """
+        Adds any of the given verbs that aren't already in irregular_verbs
+        If pool is specified, the verbs are checked by the workers (see iter_resolved_lines)
+        """
+
+        missing = sorted(verb for verb in verbs if verb not in self.irregular_verbs)
+        if not pool:
+            for verb in missing:
+                self.get_verb_irregularities(verb)
+            return
+
+        batches = [missing[i:i+batch_size] for i in range(0, len(missing), batch_size)]
+        for batch, worker_state in pool.imap(irregular_batch, batches):
+            self.add_worker_state(worker_state)
+            for verb, items in batch:
+                self.irregular_verbs.set(verb, items)
 
-        return form not in forced_reg.forms.get(formtype, [])
+    def formtypes(self, freqlist, pool=None, resolved_lines=None):
 
-    def formtypes(self, freqlist):
+        entries = self.find_lemmas(freqlist, pool, resolved_lines)
+
+        # Check all of the verbs up front, so the lookups below don't conjugate anything
+        self.index_irregular_verbs({entry.lemma for entry in entries.values() if entry.pos == "v" and entry.lemma}, pool)
 
-        entries = self.find_lemmas(freqlist)
         for form, entry in entries.items():
 
             formtypes = set()
@@ -70,46 +249,76 @@ class FrequencyList():
     def filter_names(self, freq):
 
         for k, item in freq.items():
-            usage = item["usage"]
-            word = item["word"]
+            usage = item.usage
+            word = item.word
             if not word[0].islower():
                 continue
 
-            usage.sort(key=lambda x: int(x.partition(":")[0]), reverse=True)
-            while usage:
-                count, _, form = usage[0].partition(":")
+            usage.sort()
+            names = 0
+            for count, form in zip(usage.counts, usage.forms):
                 if form[0].islower():
                     break
-                item["count"] -= int(count)
+                item.count -= count
+                names += 1
 
                 self.debug(word, "removing likely name", form, count)
 
-#                print("Removing name: ", word, [form, usage[0]], file=sys.stderr)
-                del usage[0]
+#                print("Removing name: ", word, [form, count], file=sys.stderr)
+
+            if names:
+                del usage.counts[:names]
+                del usage.forms[:names]
+
 
+    def process(self, freqlist, minuse=0, pool=None, resolved_lines=None, prune=False):
+        """
+        Yields the lemma list as csv lines, stopping at the first lemma with fewer than minuse uses
+        If prune is True, forms that can't contribute to any lemma with at least minuse uses
+        are not resolved (see prune_lines)
+        """
+        return self.iter_freqlist(self.process_items(freqlist, minuse, pool, resolved_lines, prune))
+
+    def process_items(self, freqlist, minuse=0, pool=None, resolved_lines=None, prune=False):
+        """ Same as process(), returning the FreqItems instead of csv lines """
+        entries = self.find_lemmas(freqlist, pool, resolved_lines, minuse if prune else 0)
+        return self.iter_freq_items(entries, minuse)
+
+    def process_shards(self, shard_files, minuse=0):
+        """
+        Same as process(), using the initial lookups stored in shard_files by write_shard()
+        instead of reading a frequency list
+        The shards must include every shard number of the same frequency list
+        """
+        entries = self.resolve_entries(self.iter_shards(shard_files))
+        return self.iter_freqlist(self.iter_freq_items(entries, minuse))
 
-    def process(self, freqlist, minuse=0):
-        entries = self.find_lemmas(freqlist)
+    def iter_freq_items(self, entries, minuse=0):
+        """ Yields the FreqItems for entries in list order, stopping at the first lemma with fewer than minuse uses """
         freq = self.build_freqlist(entries)
         self.filter_names(freq)
 
-        yield("count,spanish,pos,flags,usage")
-        for k, item in sorted(freq.items(), key=lambda item: (item[1]["count"]*-1, item[1]["word"])):
-            if minuse and item["count"] < minuse:
+        for k, item in sorted(freq.items(), key=lambda item: (item[1].count*-1, item[1].word)):
+            if minuse and item.count < minuse:
                 break
+            yield item
+
+    def iter_freqlist(self, items):
+        yield("count,spanish,pos,flags,usage")
+        for item in items:
             yield(
                 ",".join(
                     [
-                        str(item["count"]),
-                        item["word"],
-                        item["pos"],
-                        "; ".join(item["flags"]),
-                        "|".join(sorted(item["usage"], key=lambda x: int(x.partition(":")[0]), reverse=True)),
+                        str(item.count),
+                        item.word,
+                        item.pos,
+                        "; ".join(item.flags),
+                        str(item.usage),
                     ]
                 )
             )
 
-    def find_lemmas(self, freqlist):
+    def find_lemmas(self, freqlist, pool=None, resolved_lines=None, prune_minuse=0):
 
         """
         freqlist is an iterable of strings formatted as "[form|@lemma][:pos][\tN][\tcomponents]"
@@ -125,96 +334,56 @@ class FrequencyList():
         in either the multilemma or the maybeplural list
         words that are not part of the spanish database will have NULL pos and lemma but will not be
         included in the multilemma or maybeplural lists
-        """
 
-        entries = {}
-        multi_lemmas = []
-        maybe_plurals = []
+        pool - optional multiprocessing.Pool used to do the initial lookups (see iter_resolved_lines)
+        resolved_lines - optional ResolvedLines with the initial lookups from a previous run (see iter_incremental_lines)
+        prune_minuse - if set, skip the forms that can't contribute to a lemma with at least prune_minuse uses (see prune_lines)
+        """
 
         # Read all the entries and do an initial lookup of lemmas
-        for linenum, line in enumerate(freqlist):
-            line = line.strip()
-            modifiers = None
-            count = None
-            form, *splits = line.split("\t")
-            if len(splits) > 1:
-                modifiers = splits[1]
-            if splits:
-                count = splits[0]
-
-            form, _, pos = form.partition(":")
-            orig_form = form
-
-            if form in self.ignore:
-                continue
+        numbered_lines = enumerate(freqlist)
+        if prune_minuse:
+            numbered_lines = self.prune_lines(numbered_lines, prune_minuse)
 
-            if count:
-                count = int(count)
-            else:
-                # If the list doesn't include a counter,
-                # assign a value in descending order to preserve the list order
-                count = 100000-linenum
-                assert count > 0
-
-            lemma = None
-            if form.startswith("@"):
-                lemma = form[1:]
-                form = form[1:]
-
-            orig_case = form
-            if not pos:
-
-                # Get alternate case forms
-                if form == form.lower() or self.ngprobs.get_case_prob(form) < 10:
-                    alt_case = self.ngprobs.get_preferred_case(form.lower())
-                    if alt_case != form:
-   #                     print("using alt case", form, alt_case)
-                        self.debug(alt_case, "preferred_case", form)
-                        form = alt_case
+        if resolved_lines is not None:
+            resolved = self.iter_incremental_lines(numbered_lines, resolved_lines, pool)
+        else:
+            resolved = self.resolve_numbered_lines(numbered_lines, pool)
 
-            preferred_lemmas = self.get_preferred_lemmas(form, lemma, pos)
-            if not preferred_lemmas and orig_form != form:
-                form = orig_form
-                preferred_lemmas = self.get_preferred_lemmas(form, lemma, pos)
+        return self.resolve_entries(resolved)
 
-            self.debug(form, "possible lemmas", [(l.word, l.pos) for l in preferred_lemmas])
-
-            if not pos:
-
-                if self.maybe_plural(form, preferred_lemmas):
-                    maybe_plurals.append((orig_case, preferred_lemmas))
-                    self.debug(form, "maybe_plural")
-                else:
-                    pos = self.get_best_pos(form, preferred_lemmas)
-                    self.debug(form, "best_pos", pos)
-
-            if not lemma and pos:
-                lemmas = []
-                for l in preferred_lemmas:
-                    if l.pos == pos and l.word not in lemmas:
-                        lemmas.append(l.word)
-
-                self.debug(form, "getting lemmas", lemmas, pos)
+    def resolve_entries(self, resolved):
+        """
+        Resolves the multi_lemma and maybe_plural entries after the initial lookups
+        resolved is an iterable of resolve_line() results, in the order of the frequency list
+        returns: { "form": (pos, count, lemma), ... }
+        """
 
-                if not lemmas:
-                    raise ValueError("couldn't find lemma", form, pos)
+        entries = {}
+        multi_lemmas = []
+        maybe_plurals = []
 
-                if len(lemmas) > 1:
-                    multi_lemmas.append((orig_case, preferred_lemmas))
-                    lemma = None
-                    self.debug(form, "multi_lemma")
-                else:
-                    lemma = lemmas[0]
+        for item in resolved:
+            if not item:
+                continue
 
-            entries[orig_case] = Entry(pos, count, lemma)
+            orig_case, entry, status, preferred_lemmas = item
+            entries[orig_case] = entry
 
-#            if form == self.DEBUG_WORD:
-#                exit()
+            if status == "multi_lemma":
+                multi_lemmas.append((orig_case, preferred_lemmas))
+            elif status == "maybe_plural":
+                maybe_plurals.append((orig_case, preferred_lemmas))
 
         # count all forms of all lemmas so far, used to pick
         # the most popular lemmas from words with multiple lemmas
         lemma_freq = self.get_lemma_freq(entries)
 
+        if self.profiler:
+            self.profiler.count("forms", len(entries))
+            self.profiler.count("multi_lemmas", len(multi_lemmas))
+            self.profiler.count("maybe_plurals", len(maybe_plurals))
+
         for form, preferred_lemmas in multi_lemmas:
             entry = entries[form]
 
@@ -233,6 +402,335 @@ class FrequencyList():
         return entries
 
 
+    @staticmethod
+    def get_shard(line, num_shards):
+        """ Returns the shard number of a frequency list line, based on a hash of its lowercased form """
+        form = line.strip().split("\t")[0].partition(":")[0].removeprefix("@").lower()
+        return int.from_bytes(hashlib.md5(form.encode()).digest()[:8], "little") % num_shards
+
+    def write_shard(self, freqlist, shard, num_shards, outfile, pool=None):
+        """
+        Does the initial lookup of the lines of freqlist in the given shard (see get_shard) and writes
+        them to outfile as JSON lines of [linenum, orig_case, [pos, count, lemma], status, preferred_lemmas]
+        Shards can be resolved separately and combined with process_shards()
+        """
+
+        numbered_lines = [(linenum, line) for linenum, line in enumerate(freqlist) if self.get_shard(line, num_shards) == shard]
+        for (linenum, line), item in zip(numbered_lines, self.resolve_numbered_lines(numbered_lines, pool)):
+            if not item:
+                continue
+            outfile.write(json.dumps([linenum, *self.export_resolved(item)], ensure_ascii=False))
+            outfile.write("\n")
+
+    def iter_shards(self, shard_files):
+        """ Yields the resolve_line() results stored in shard_files, in the order of the original frequency list """
+
+        def iter_shard(filename):
+            with open(filename) as infile:
+                for line in infile:
+                    yield json.loads(line)
+
+        for linenum, *item in heapq.merge(*[iter_shard(filename) for filename in shard_files], key=lambda x: x[0]):
+            yield self.load_resolved(item)
+
+    def resolve_line(self, linenum, line):
+        """
+        Does the initial lemma lookup for a single line of a frequency list (see find_lemmas)
+        returns (orig_case, Entry, status, preferred_lemmas) or None if the form is ignored
+        status is "multi_lemma" or "maybe_plural" if the entry needs to be resolved
+        after all of the other lines have been processed, otherwise None
+        """
+
+        line = line.strip()
+        modifiers = None
+        count = None
+        form, *splits = line.split("\t")
+        if len(splits) > 1:
+            modifiers = splits[1]
+        if splits:
+            count = splits[0]
+
+        form, _, pos = form.partition(":")
+        orig_form = form
+
+        if form in self.ignore:
+            return
+
+        if count:
+            count = int(count)
+        else:
+            # If the list doesn't include a counter,
+            # assign a value in descending order to preserve the list order
+            count = 100000-linenum
+            assert count > 0
+
+        lemma = None
+        if form.startswith("@"):
+            lemma = form[1:]
+            form = form[1:]
+
+        orig_case = form
+        if not pos:
+
+            # Get alternate case forms
+            if form == form.lower() or self.ngprobs.get_case_prob(form) < 10:
+                alt_case = self.ngprobs.get_preferred_case(form.lower())
+                if alt_case != form:
+   #                     print("using alt case", form, alt_case)
+                    self.debug(alt_case, "preferred_case", form)
+                    form = alt_case
+
+        status = None
+        preferred_lemmas = self.get_preferred_lemmas(form, lemma, pos)
+        if not preferred_lemmas and orig_form != form:
+            form = orig_form
+            preferred_lemmas = self.get_preferred_lemmas(form, lemma, pos)
+
+        if form in self.debug_words:
+            self.debug(form, "possible lemmas", [(l.word, l.pos) for l in preferred_lemmas])
+
+        if not pos:
+
+            if self.maybe_plural(form, preferred_lemmas):
+                status = "maybe_plural"
+                self.debug(form, "maybe_plural")
+            else:
+                pos = self.get_best_pos(form, preferred_lemmas)
+                self.debug(form, "best_pos", pos)
+
+        if not lemma and pos:
+            lemmas = []
+            for l in preferred_lemmas:
+                if l.pos == pos and l.word not in lemmas:
+                    lemmas.append(l.word)
+
+            self.debug(form, "getting lemmas", lemmas, pos)
+
+            if not lemmas:
+                raise ValueError("couldn't find lemma", form, pos)
+
+            if len(lemmas) > 1:
+                status = "multi_lemma"
+                lemma = None
+                self.debug(form, "multi_lemma")
+            else:
+                lemma = lemmas[0]
+
+        return orig_case, Entry(pos, count, lemma), status, preferred_lemmas
+
+    def iter_resolved_lines(self, freqlist, pool=None, batch_size=1000):
+        """
+        Yields resolve_line() for every line in freqlist, in order
+        If pool is specified, the lines are resolved in batches by the worker processes
+        of a multiprocessing.Pool created with initializer=init_worker
+        """
+
+        return self.resolve_numbered_lines(enumerate(freqlist), pool, batch_size)
+
+    def resolve_numbered_lines(self, numbered_lines, pool=None, batch_size=1000):
+        """ Yields resolve_line() for every (linenum, line) in numbered_lines, in order """
+
+        if not pool:
+            for linenum, line in numbered_lines:
+                yield self.resolve_line(linenum, line)
+            return
+
+        for batch, worker_state in pool.imap(resolve_batch, self.iter_batches(numbered_lines, batch_size)):
+            self.add_worker_state(worker_state)
+            for item in batch:
+                yield self.import_resolved(item)
+
+    def iter_incremental_lines(self, numbered_lines, resolved_lines, pool=None):
+        """
+        Yields resolve_line() for every (linenum, line) in numbered_lines, in order, reusing the results
+        stored in resolved_lines (a ResolvedLines) for any line whose fingerprint hasn't changed
+        The results of the current run are stored in resolved_lines
+        """
+
+        numbered_lines = list(numbered_lines)
+        results = [None] * len(numbered_lines)
+        keys = [resolved_lines.get_key(linenum, line) for linenum, line in numbered_lines]
+        # Every line stores its fingerprint, whether it's reused or resolved again
+        fingerprints = [self.get_line_fingerprint(line) for linenum, line in numbered_lines]
+
+        changed = []
+        for idx, (linenum, line) in enumerate(numbered_lines):
+            key = keys[idx]
+            stored = resolved_lines.get(key)
+            if stored:
+                fingerprint, exported = stored
+                if fingerprints[idx] == fingerprint:
+                    results[idx] = self.load_resolved(exported)
+                    resolved_lines.set(key, fingerprint, exported)
+                    resolved_lines.reused += 1
+                    continue
+            changed.append((idx, linenum, line))
+
+        recomputed = self.resolve_numbered_lines([(linenum, line) for _, linenum, line in changed], pool)
+        for (idx, linenum, line), item in zip(changed, recomputed):
+            results[idx] = item
+            exported = self.export_resolved(item)
+            resolved_lines.set(keys[idx], fingerprints[idx], exported)
+            resolved_lines.recomputed += 1
+
+        return iter(results)
+
+    def prune_lines(self, numbered_lines, minuse):
+        """
+        Returns the (linenum, line) items from numbered_lines that could contribute to a lemma
+        with at least minuse uses
+
+        Every form is linked to its candidate lemmas (see get_candidate_lemmas), and the upper bound
+        for a lemma is the total count of all of the forms linked to it. The forms and lemmas
+        linked to each other are resolved together: plural and multi-lemma resolution compare the
+        counts of other forms and lemmas in the group, so a group is only skipped if none of its
+        lemmas can reach minuse
+        """
+
+        numbered_lines = list(numbered_lines)
+        parent = {}
+
+        def find(node):
+            root = node
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while node != root:
+                parent[node], node = root, parent[node]
+            return root
+
+        upper_bound = defaultdict(int)
+        line_nodes = []
+        for linenum, line in numbered_lines:
+            form, *splits = line.strip().split("\t")
+            form = form.partition(":")[0]
+            try:
+                count = int(splits[0]) if splits and splits[0] else 100000-linenum
+            except ValueError:
+                count = minuse
+
+            node = ("form", form)
+            line_nodes.append(node)
+            for lemma in self.get_candidate_lemmas(form.removeprefix("@")):
+                upper_bound[lemma] += count
+                parent[find(node)] = find(("lemma", lemma))
+
+        live = {find(("lemma", lemma)) for lemma, count in upper_bound.items() if count >= minuse}
+        kept = [item for item, node in zip(numbered_lines, line_nodes) if find(node) in live]
+
+        if self.profiler:
+            self.profiler.count("pruned_forms", len(numbered_lines) - len(kept))
+
+        return kept
+
+    def get_candidate_lemmas(self, form):
+        """
+        Returns the set of words that form could possibly be resolved to: the form itself,
+        its case variations, any plural's feminine singular, and everything they
+        are linked to in allforms, followed until no new lemmas are found
+        """
+
+        seeds = {form, form.lower(), self.ngprobs.get_preferred_case(form.lower())}
+        if form.endswith("as"):
+            seeds.add(form[:-1])
+
+        lemmas = set()
+        pending = list(seeds)
+        while pending:
+            word = pending.pop()
+            if word in lemmas:
+                continue
+            lemmas.add(word)
+            for poslemma in self.allforms.get_lemmas(word):
+                pending.append(poslemma.partition("|")[2])
+
+        return lemmas
+
+    def load_resolved(self, item):
+        """ Converts an export_resolved() item that was stored as JSON back to a resolve_line() result """
+        if not item:
+            return None
+
+        orig_case, entry, status, preferred_lemmas = item
+        if preferred_lemmas is not None:
+            preferred_lemmas = [tuple(l) for l in preferred_lemmas]
+        return self.import_resolved((orig_case, Entry(*entry), status, preferred_lemmas))
+
+    def get_line_fingerprint(self, line, max_depth=3):
+        """
+        Returns a hash of the line and of the dictionary data that its resolve_line() result depends on:
+        every Word reachable from the form and its case variations through allforms (the lemmas that
+        declare the form) and through form_of, followed deeper than get_resolved_lemmas() goes with max_depth
+        """
+
+        form = line.strip().split("\t")[0].partition(":")[0].removeprefix("@")
+        seeds = {form, form.lower(), self.ngprobs.get_preferred_case(form.lower())}
+
+        data = [line.strip(), form in self.ignore]
+        seen = set()
+        pending = [(word, max_depth+2) for word in sorted(seeds)]
+        while pending:
+            word, depth = pending.pop(0)
+            if word in seen:
+                continue
+            seen.add(word)
+
+            poslemmas = self.allforms.get_lemmas(word)
+            data.append((word, poslemmas))
+            words = list(self.wordlist.get_iwords(word))
+            data += [self.get_word_data(w) for w in words]
+            if not depth:
+                continue
+
+            linked = {poslemma.partition("|")[2] for poslemma in poslemmas}
+            for w in words:
+                linked |= w.form_of.keys()
+            pending += [(lemma, depth-1) for lemma in sorted(linked)]
+
+        return hashlib.sha1(repr(data).encode()).hexdigest()
+
+    @staticmethod
+    def get_word_data(w):
+        """ Returns the parts of a Word that are used to resolve lemmas """
+        return (
+            w.word,
+            w.pos,
+            w.meta,
+            w.genders,
+            sorted((k, sorted(v)) for k, v in w.forms.items()),
+            sorted((k, sorted(v)) for k, v in w.form_of.items()),
+            [(s.gloss, s.qualifier, s.formtype) for s in w.senses],
+        )
+
+    @staticmethod
+    def iter_batches(numbered_lines, batch_size):
+        batch = []
+        for linenum, line in numbered_lines:
+            batch.append((linenum, line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def export_resolved(self, item):
+        """ Converts the Word objects in a resolve_line() result to (word, pos, index) tuples """
+        if not item:
+            return item
+
+        orig_case, entry, status, preferred_lemmas = item
+        if not status:
+            return orig_case, entry, status, None
+
+        return orig_case, entry, status, [(l.word, l.pos, self.get_word_index(l)) for l in preferred_lemmas]
+
+    def import_resolved(self, item):
+        """ Reverses export_resolved() """
+        if not item or not item[2]:
+            return item
+
+        orig_case, entry, status, preferred_lemmas = item
+        return orig_case, entry, status, [self.get_indexed_word(*l) for l in preferred_lemmas]
+
     def resolve_plurals(self, entries, lemma_freq, form, preferred_lemmas):
 
         # process plurals after all other lemmas have been processed
@@ -297,7 +795,8 @@ class FrequencyList():
         best = None
         checked_lemmas = []
 
-        self.debug(form, "checking lemmas", [(l.pos, l.word) for l in preferred_lemmas])
+        if form in self.debug_words:
+            self.debug(form, "checking lemmas", [(l.pos, l.word) for l in preferred_lemmas])
 
         allowed_pos = self.get_all_pos(preferred_lemmas)
         for l in preferred_lemmas:
@@ -342,6 +841,48 @@ class FrequencyList():
 
         return any(l.pos != "v" and l.word != form for l in lemmas)
 
+    def get_lemma_flags(self, word):
+        """
+        Returns the FLAG_* bits for a Word
+        The flags are computed once for every Word sharing the same word/pos and stored in lemma_flags
+        """
+        flags = self.lemma_flags.get(word)
+        if flags is None:
+            self.index_lemma_flags(word.word, word.pos)
+            flags = self.lemma_flags.get(word)
+
+            # Words that aren't in the wordlist are never primary lemmas
+            if flags is None:
+                flags = self.compute_lemma_flags(word)
+                self.lemma_flags[word] = flags
+
+        return flags
+
+    def index_lemma_flags(self, lemma, pos):
+        """ Stores the flags for all of the Words matching lemma/pos in lemma_flags """
+
+        # A lemma is primary if it and every word declared above it are lemmas
+        all_lemmas = True
+        for w in self.wordlist.get_iwords(lemma, pos):
+            flags = self.compute_lemma_flags(w)
+            all_lemmas = all_lemmas and flags & self.FLAG_LEMMA
+            if all_lemmas:
+                flags |= self.FLAG_PRIMARY
+            # Equal words share the flags of the first match, like is_primary_lemma() always has
+            self.lemma_flags.setdefault(w, flags)
+
+    def compute_lemma_flags(self, w):
+        """ Returns the FLAG_* bits for a Word, except FLAG_PRIMARY which depends on the other words """
+
+        flags = 0
+        if w.senses and w.senses[0].formtype:
+            flags |= self.FLAG_FORMTYPE_FIRST_SENSE
+        if self.check_lemma(w):
+            flags |= self.FLAG_LEMMA
+        if self.check_rare_lemma(w):
+            flags |= self.FLAG_RARE
+        return flags
+
     def is_lemma(self, w):
         """
         This is a very strict definition of a lemma, the first word declared on a page:
@@ -350,6 +891,12 @@ class FrequencyList():
            + it's not a feminine equivalent of
            + it's not labelled archaic
         """
+        if not w:
+            return False
+        return bool(self.get_lemma_flags(w) & self.FLAG_LEMMA)
+
+    def check_lemma(self, w):
+        """ Uncached implementation of is_lemma() """
 
         if not w or not w.senses:
             return False
@@ -389,9 +936,29 @@ class FrequencyList():
         form is the form that claimed a relationship with word, used to filter out non-reciprocal lemmas
         formtypes: any relationships 'form' claims to have to 'word', else None
         Returns a list of Word objects, may contain duplicates
+
+        The result only depends on word and max_depth, so each word is only followed once
+        and stored in form_of_closure
         """
 
-        if max_depth<3:
+        # Don't use the stored results for the debug word so the resolution can be traced
+        if word.word in self.debug_words:
+            return self.follow_form_of(word, form, formtypes, max_depth)
+
+        key = (word, max_depth)
+        lemmas = self.form_of_closure.get(key)
+        if lemmas is None:
+            if self.form_of_problems is not None and max_depth == 3:
+                self.form_of_problems += self.check_form_of_chain(word, max_depth)
+            lemmas = tuple(self.follow_form_of(word, form, formtypes, max_depth))
+            self.form_of_closure[key] = lemmas
+
+        return list(lemmas)
+
+    def follow_form_of(self, word, form, formtypes, max_depth):
+        """ Uncached implementation of get_resolved_lemmas() """
+
+        if max_depth<3 and self.form_of_problems is None:
             print("resolving deep lemma", word.word, word.pos, form, formtypes, max_depth, file=sys.stderr)
 
         lemmas = []
@@ -417,11 +984,40 @@ class FrequencyList():
                 lemmas += self.get_resolved_lemmas(w, lemma, lemma_formtypes, max_depth-1)
 
             else:
-                print(f"Lemma recursion exceeded: {word.word} {word.pos} -> {lemma}", file=sys.stderr)
+                if self.form_of_problems is None:
+                    print(f"Lemma recursion exceeded: {word.word} {word.pos} -> {lemma}", file=sys.stderr)
                 return []
 
         return lemmas
 
+    def check_form_of_chain(self, word, max_depth=3):
+        """
+        Follows the form-of links from word the same way as get_resolved_lemmas()
+        Returns a list of strings describing any cycles and any chains longer than max_depth
+        """
+
+        problems = []
+
+        def follow(w, path):
+            if self.is_lemma(w):
+                return
+
+            for lemma in w.form_of:
+                target = next(self.wordlist.get_iwords(lemma, w.pos), None)
+                if not target:
+                    continue
+
+                chain = " -> ".join(f"{x.word}:{x.pos}" for x in path + [target])
+                if target in path:
+                    problems.append(f"cycle: {chain}")
+                elif len(path) > max_depth and not self.is_lemma(target):
+                    problems.append(f"too deep: {chain}")
+                else:
+                    follow(target, path + [target])
+
+        follow(word, [word])
+        return problems
+
     def get_preferred_lemmas(self, form, filter_word=None, filter_pos=None):
         """
         form - the form to find lemmas
@@ -431,6 +1027,72 @@ class FrequencyList():
         Return a list of lemma objects
         """
 
+        # Don't use the caches for the debug word so the resolution can be traced
+        if form in self.debug_words:
+            return self.resolve_preferred_lemmas(form, filter_word, filter_pos)
+
+        if self.lemma_memo is None:
+            return self.get_stored_lemmas(form, filter_word, filter_pos)
+
+        key = (form, filter_word, filter_pos)
+        lemmas = self.lemma_memo.get(key)
+        if lemmas is None:
+            lemmas = tuple(self.get_stored_lemmas(form, filter_word, filter_pos))
+            self.lemma_memo.set(key, lemmas)
+
+        return list(lemmas)
+
+    def pop_worker_state(self):
+        """
+        Returns the lemma_cache items added and the lemma_memo counters of a pool worker since the last call,
+        see LemmaCache.pop_pending() and LRUCache.pop_counters()
+        """
+        cache_items = self.lemma_cache.pop_pending() if self.lemma_cache else []
+        memo_counters = self.lemma_memo.pop_counters() if self.lemma_memo is not None else None
+        return cache_items, memo_counters
+
+    def add_worker_state(self, state):
+        """ Adds the pop_worker_state() of a pool worker to lemma_cache and the lemma_memo counters """
+        cache_items, memo_counters = state
+        if self.lemma_cache and cache_items:
+            self.lemma_cache.add_pending(cache_items)
+        if self.lemma_memo is not None and memo_counters:
+            self.lemma_memo.add_counters(memo_counters)
+
+    def get_stored_lemmas(self, form, filter_word, filter_pos):
+        """ get_preferred_lemmas() backed by the persistent lemma_cache, if available """
+
+        if self.lemma_cache is None:
+            return self.resolve_preferred_lemmas(form, filter_word, filter_pos)
+
+        cached = self.lemma_cache.get(form, filter_word, filter_pos)
+        if cached is not None:
+            lemmas = [self.get_indexed_word(lemma, pos, index) for lemma, pos, index in cached]
+            if all(lemmas):
+                return lemmas
+
+        lemmas = self.resolve_preferred_lemmas(form, filter_word, filter_pos)
+        indexed = [(l.word, l.pos, self.get_word_index(l)) for l in lemmas]
+        if all(index is not None for _, _, index in indexed):
+            self.lemma_cache.set(form, filter_word, filter_pos, indexed)
+
+        return lemmas
+
+    def get_word_index(self, word):
+        """ Returns the position of word in wordlist.get_iwords(word.word, word.pos) or None """
+        for index, w in enumerate(self.wordlist.get_iwords(word.word, word.pos)):
+            if w is word or w == word:
+                return index
+
+    def get_indexed_word(self, lemma, pos, index):
+        """ Returns the Word at position index in wordlist.get_iwords(lemma, pos) or None """
+        for i, w in enumerate(self.wordlist.get_iwords(lemma, pos)):
+            if i == index:
+                return w
+
+    def resolve_preferred_lemmas(self, form, filter_word=None, filter_pos=None):
+        """ Uncached implementation of get_preferred_lemmas() """
+
         # workaround for "part"/"v" splits
         # "abierto" is "part", but its lemma "abrir" is "v"
         # Use "part" above to get the list of lemmas, then use "v" below to filter the lemmas
@@ -439,7 +1101,8 @@ class FrequencyList():
 
         unresolved = self.get_unresolved_items(form, filter_pos)
         self.debug(form, "get_preferred_lemmas", filter_word, filter_pos)
-        self.debug(form, "  unresolved items", [(l.word, l.pos, formtypes) for l, formtypes in unresolved])
+        if form in self.debug_words:
+            self.debug(form, "  unresolved items", [(l.word, l.pos, formtypes) for l, formtypes in unresolved])
         if not unresolved:
             self.debug("  no unresolved items, using get_all_lemmas instead")
             unresolved = [(item, None) for item in self.get_all_lemmas(form, filter_pos)]
@@ -451,11 +1114,13 @@ class FrequencyList():
         filtered = [x for x in unresolved if not self.is_rare_lemma(x[0])]
         unresolved = filtered if filtered else unresolved
 
-        self.debug(form, f"  unresolved items ({len(filtered)} passed filter)", [(l.word, l.pos, formtypes) for l, formtypes in unresolved])
+        if form in self.debug_words:
+            self.debug(form, f"  unresolved items ({len(filtered)} passed filter)", [(l.word, l.pos, formtypes) for l, formtypes in unresolved])
         lemmas = []
         for w, formtypes in unresolved:
             resolved_lemmas = self.get_resolved_lemmas(w, form, formtypes)
-            self.debug(form, f"  resolved {w.word}:{w.pos} to", [(l.word, l.pos) for l in resolved_lemmas])
+            if form in self.debug_words:
+                self.debug(form, f"  resolved {w.word}:{w.pos} to", [(l.word, l.pos) for l in resolved_lemmas])
             lemmas += resolved_lemmas
 
         if not lemmas:
@@ -463,11 +1128,12 @@ class FrequencyList():
 
         if filter_word or filter_pos:
             lemmas = self.filter_lemmas(lemmas, filter_word, filter_pos)
-            self.debug(form, f"  filtered {filter_word}/{filter_pos}, remaining", [(l.word, l.pos) for l in lemmas])
+            if form in self.debug_words:
+                self.debug(form, f"  filtered {filter_word}/{filter_pos}, remaining", [(l.word, l.pos) for l in lemmas])
 
         # Remove rare lemmas from resolved lemmas
         filtered_lemmas = self.filter_rare_lemmas(lemmas)
-        if len(lemmas) != len(filtered_lemmas):
+        if len(lemmas) != len(filtered_lemmas) and form in self.debug_words:
             self.debug(form, "filtered rare", len(lemmas), [(l.word, l.pos) for l in lemmas], len(filtered_lemmas), [(l.word, l.pos) for l in filtered_lemmas])
         lemmas = filtered_lemmas if filtered_lemmas else lemmas
 
@@ -486,7 +1152,8 @@ class FrequencyList():
         items = []
 
         for word in self.wordlist.get_iwords(form, pos):
-            self.debug(form, "claimed", word.word, word.pos, [form, pos])
+            if form in self.debug_words:
+                self.debug(form, "claimed", word.word, word.pos, [form, pos])
             if self.is_lemma(word):
                 if word not in seen:
                     items.append((word, None))
@@ -589,7 +1256,8 @@ class FrequencyList():
                 lemma_pos = "v"
             self.debug(form, "declaring poslemma", lemma_pos, lemma)
             for word in self.wordlist.get_iwords(lemma, lemma_pos):
-                self.debug(form, "declaring", word.word, word.pos, self.is_lemma(word), word.has_form(form))
+                if form in self.debug_words:
+                    self.debug(form, "declaring", word.word, word.pos, self.is_lemma(word), word.has_form(form))
                 if self.is_lemma(word) and word.has_form(form):
                     # TODO: get formtypes?
                     items.append(word)
@@ -646,11 +1314,18 @@ class FrequencyList():
         if "num" in all_pos:
             return [ (form, "num", 1) ] + [ (form, pos, 0) for pos in all_pos if pos != "num" ]
 
-        ng_usage_count = [ (form, pos, self.ngprobs.get_usage_count(form, pos)) for pos in all_pos ]
-        ng_usage_count.sort(key=lambda k: (int(k[2])*-1, k[1], k[0]))
+        if self.pos_ranks is not None:
+            ng_usage_count = self.pos_ranks.get(form, all_pos)
+            if ng_usage_count is not None:
+                self.debug(form, "ng_probs (precomputed)", ng_usage_count)
+                return ng_usage_count
 
-        if form == self.DEBUG_WORD:
-            print("ng_probs", ng_usage_count)
+        # all_pos is sorted, so a stable sort by count gives the same order as sorting by (-count, pos)
+        counts = self.ngprobs.get_usage_counts([form], all_pos)
+        ranked = sorted(range(len(all_pos)), key=counts.__getitem__, reverse=True)
+        ng_usage_count = [ (form, all_pos[i], counts[i]) for i in ranked ]
+
+        self.debug(form, "ng_probs", ng_usage_count)
 
         return ng_usage_count
 
@@ -690,6 +1365,7 @@ class FrequencyList():
 
 
     def get_lemma_freq(self, entries):
+        """ Returns { (lemma, pos): LemmaUsage } """
 
         lemma_freq = {}
         for form, entry in entries.items():
@@ -698,17 +1374,18 @@ class FrequencyList():
 
             tag = (lemma, pos)
 
-            if tag not in lemma_freq:
-                lemma_freq[tag] = {"count": 0, "usage": []}
+            item = lemma_freq.get(tag)
+            if item is None:
+                item = lemma_freq[tag] = LemmaUsage()
 
-            lemma_freq[tag]["count"] += entry.count
-            lemma_freq[tag]["usage"].append(f"{entry.count}:{form}")
+            item.add(entry.count, form)
 
             self.debug(form, "counting", entry)
 
         return lemma_freq
 
     def build_freqlist(self, entries):
+        """ Returns { (lemma, pos): FreqItem } """
 
         lemma_freq = self.get_lemma_freq(entries)
 
@@ -716,20 +1393,14 @@ class FrequencyList():
         usage = defaultdict(dict)
         count = 1
 
-        for tag, item in sorted(lemma_freq.items(), key=lambda x: (x[1]["count"]*-1, x[0])):
+        for tag, item in sorted(lemma_freq.items(), key=lambda x: (x[1].count*-1, x[0])):
             lemma, pos = tag
 
             flags = self.get_flags(lemma, pos)
 
-            usage[lemma][pos] = item["count"]
+            usage[lemma][pos] = item.count
 
-            freq[tag] = {
-                "count": item["count"],
-                "word": lemma,
-                "pos": pos,
-                "flags": flags,
-                "usage": item["usage"],
-            }
+            freq[tag] = FreqItem(item.count, lemma, pos, flags, item)
 
             count += 1
 
@@ -743,7 +1414,7 @@ class FrequencyList():
             best_pos = ""
             for pos, count in all_pos.items():
                 # ignore anything that's already flagged for dismissal
-                if len(freq[(lemma, pos)]["flags"]):
+                if len(freq[(lemma, pos)].flags):
                     continue
                 if count > best_count:
                     best_count = count
@@ -752,17 +1423,12 @@ class FrequencyList():
             popular_pos = []
             for pos, count in all_pos.items():
                 if count < best_count:
-                    freq[(lemma, pos)]["flags"].append("DUPLICATE")
+                    freq[(lemma, pos)].flags.append("DUPLICATE")
 
         return freq
 
     def is_primary_lemma(self, word):
-        for w in self.wordlist.get_iwords(word.word, word.pos):
-            if not self.is_lemma(w):
-                return False
-            if w == word:
-                return True
-        return False
+        return bool(self.get_lemma_flags(word) & self.FLAG_PRIMARY)
 
     def filter_secondary_lemmas(self, lemmas):
         filtered_lemmas = [lemma for lemma in lemmas if self.is_primary_lemma(lemma)]
@@ -775,6 +1441,10 @@ class FrequencyList():
         """
         Returns False if word has any non-form sense not flagged rare/archaic
         """
+        return bool(self.get_lemma_flags(word) & self.FLAG_RARE)
+
+    def check_rare_lemma(self, word):
+        """ Uncached implementation of is_rare_lemma() """
 
         has_nonrare_sense = False
         for sense in word.senses:
@@ -812,7 +1482,8 @@ class FrequencyList():
         # Pick the more common lemma
         # NOTE: this only looks at the count for the raw lemma, not the count of the lemma plus all of its forms
         for lemma in lemmas:
-            count = lemma_freq.get((lemma, pos), {}).get("count",-1)
+            usage = lemma_freq.get((lemma, pos))
+            count = usage.count if usage else -1
             if count > best_count:
                 best = lemma
                 best_count = count
@@ -833,8 +1504,9 @@ class FrequencyList():
 
         if best is None and len(lemmas):
 
-            usage = [(self.ngprobs.get_usage_count(lemma, pos), lemma) for lemma in lemmas]
-            ranked = sorted(usage, key=lambda x: (x[0]*-1, x[1]))
+            sorted_lemmas = sorted(lemmas)
+            counts = self.ngprobs.get_usage_counts(sorted_lemmas, [pos])
+            ranked = [(counts[i], sorted_lemmas[i]) for i in sorted(range(len(sorted_lemmas)), key=counts.__getitem__, reverse=True)]
             self.debug(form, pos, "get_best_lemma", lemmas, "no best, using ngprobs frequency", ranked)
             print("$$$$", [form, pos], "get_best_lemma", ranked)
 
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+import os
+import sqlite3
+
+class FreqDB():
+    """
+    Indexed SQLite version of the make_freq lemma list
+
+    Rows are stored in list order (rank), with the flags stored as a bitmask so readers can
+    skip rows with unwanted flags in the query instead of parsing the flags of every row
+    """
+
+    HEADER = b"SQLite format 3\x00"
+
+    def __init__(self, filename):
+        self.db = sqlite3.connect(filename)
+
+    @classmethod
+    def is_freq_db(cls, filename):
+        """ Returns True if filename is an SQLite database rather than a csv list """
+        with open(filename, "rb") as infile:
+            return infile.read(len(cls.HEADER)) == cls.HEADER
+
+    @classmethod
+    def create(cls, filename, items):
+        """ Writes the FreqItems from FrequencyList.process_items() to filename, replacing any existing list """
+
+        if os.path.exists(filename):
+            os.remove(filename)
+
+        self = cls(filename)
+        db = self.db
+        db.execute("""CREATE TABLE freq (
+            rank INTEGER PRIMARY KEY, count INTEGER, spanish TEXT, pos TEXT, flags INTEGER, usage TEXT)""")
+        db.execute("CREATE TABLE flags (name TEXT PRIMARY KEY, bit INTEGER)")
+
+        flag_bits = {}
+        def get_mask(flags):
+            mask = 0
+            for flag in flags:
+                if flag not in flag_bits:
+                    flag_bits[flag] = 1 << len(flag_bits)
+                mask |= flag_bits[flag]
+            return mask
+
+        db.executemany("INSERT INTO freq VALUES (?, ?, ?, ?, ?, ?)",
+                ((rank, item.count, item.word, item.pos, get_mask(item.flags), str(item.usage)) for rank, item in enumerate(items)))
+        db.executemany("INSERT INTO flags VALUES (?, ?)", flag_bits.items())
+        db.commit()
+        return self
+
+    def get_flag_bits(self):
+        return dict(self.db.execute("SELECT name, bit FROM flags"))
+
+    def get_flags(self, mask):
+        return [name for name, bit in sorted(self.get_flag_bits().items(), key=lambda x: x[1]) if mask & bit]
+
+    def iter_rows(self, allowed_flags=[], limit=0):
+        """
+        Yields {"spanish", "pos", "count"} for every row without any flags outside of allowed_flags, in list order
+        The rows are read from the database as they're consumed
+
+        If limit is specified, the rows are queried limit at a time, so a reader that stops after the
+        first limit rows never queries the rest of the list. Readers that skip rows or allow existing
+        items past the limit (like DeckBuilder.load_wordlist_rows) still get every row they ask for
+        """
+
+        disallowed = 0
+        for name, bit in self.get_flag_bits().items():
+            if name not in allowed_flags:
+                disallowed |= bit
+
+        if not limit:
+            for spanish, pos, count in self.db.execute("SELECT spanish, pos, count FROM freq WHERE flags & ? = 0 ORDER BY rank", (disallowed,)):
+                yield {"spanish": spanish, "pos": pos, "count": count}
+            return
+
+        last_rank = -1
+        while True:
+            rows = self.db.execute("SELECT rank, spanish, pos, count FROM freq WHERE flags & ? = 0 AND rank > ? ORDER BY rank LIMIT ?",
+                    (disallowed, last_rank, limit)).fetchall()
+            for last_rank, spanish, pos, count in rows:
+                yield {"spanish": spanish, "pos": pos, "count": count}
+            if len(rows) < limit:
+                return
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+import json
+import os
+
+from .lemma_cache import stat_files
+
+class IrregularVerbs():
+    """
+    Table of the forms of each verb that differ from its regular conjugation, used by
+    FrequencyList.is_irregular_verb and is_irregular_form
+
+    Each verb is stored as a list with an item for every Word in wordlist.get_iwords(verb, "v"):
+    (irregular, {(formtype, form), ...}) where irregular is True if any of the Word's forms
+    differ from the regular paradigm and the set contains the Word's forms that aren't regular
+
+    If filename is provided, the table is loaded from and saved to the file, tied to the
+    input files (dictionary), and discarded when any of them is modified (see stat_files)
+    """
+
+    # Increment when changes to FrequencyList would change the irregular forms
+    VERSION = 1
+
+    def __init__(self, filename=None, input_files=[]):
+        self.filename = filename
+        self.verbs = {}
+
+        if not filename:
+            return
+
+        self.inputs_hash = stat_files(input_files, f"IrregularVerbs {self.VERSION}")
+        if os.path.exists(filename):
+            with open(filename) as infile:
+                data = json.load(infile)
+            if data.get("inputs_hash") == self.inputs_hash:
+                self.verbs = {verb: self.import_items(items) for verb, items in data["verbs"].items()}
+
+    def get(self, verb):
+        """ Returns the list of (irregular, irregular_forms) for verb or None if the verb isn't in the table """
+        return self.verbs.get(verb)
+
+    def set(self, verb, items):
+        self.verbs[verb] = items
+
+    def __contains__(self, verb):
+        return verb in self.verbs
+
+    def __len__(self):
+        return len(self.verbs)
+
+    @staticmethod
+    def export_items(items):
+        return [(irregular, sorted(forms)) for irregular, forms in items]
+
+    @staticmethod
+    def import_items(items):
+        return [(irregular, frozenset(tuple(form) for form in forms)) for irregular, forms in items]
+
+    def save(self):
+        if not self.filename:
+            return
+
+        with open(self.filename, "w") as outfile:
+            data = {verb: self.export_items(items) for verb, items in sorted(self.verbs.items())}
+            json.dump({"inputs_hash": self.inputs_hash, "verbs": data}, outfile, ensure_ascii=False)
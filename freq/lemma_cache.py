@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+import sqlite3
+
+def stat_files(filenames, salt=""):
+    """
+    Returns a hex digest of salt and the path, size and modification time of all of the given files
+    Unlike hashing their contents, this doesn't read the files, but it doesn't notice a change that
+    keeps the size and mtime
+    """
+    h = hashlib.sha1(salt.encode())
+    for filename in filenames:
+        stat = os.stat(filename)
+        h.update(f"{os.path.abspath(filename)}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode())
+    return h.hexdigest()
+
+class LemmaCache():
+    """
+    Persistent cache of FrequencyList.get_preferred_lemmas() results
+
+    Each result is stored as a list of (lemma, pos, index) items, where index is
+    the position of the lemma's Word in wordlist.get_iwords(lemma, pos)
+
+    The cache is tied to the input files (dictionary, allforms) and is cleared
+    automatically when any of them is modified (see stat_files)
+
+    A read_only cache never writes to the database, new items are kept until they're
+    collected with pop_pending() and passed to the writer's add_pending(). This lets pool
+    workers share the cache without competing for the database write lock
+    """
+
+    # Increment when changes to FrequencyList would change the resolved lemmas
+    VERSION = 1
+
+    def __init__(self, filename, input_files, commit_interval=10000, read_only=False):
+        self.inputs_hash = stat_files(input_files, f"LemmaCache {self.VERSION}")
+        self._commit_interval = commit_interval
+        self._pending = {}
+        self.read_only = read_only
+
+        if read_only:
+            self.db = sqlite3.connect(f"file:{filename}?mode=ro", uri=True)
+            res = self.db.execute("SELECT value FROM meta WHERE key='inputs_hash'").fetchone()
+            # The writer clears the cache when the inputs change, until then its items are stale
+            self._stale = not res or res[0] != self.inputs_hash
+            return
+
+        self._stale = False
+        self.db = sqlite3.connect(filename)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS lemmas (
+            form TEXT, filter_word TEXT, filter_pos TEXT, lemmas TEXT,
+            PRIMARY KEY (form, filter_word, filter_pos))""")
+
+        res = self.db.execute("SELECT value FROM meta WHERE key='inputs_hash'").fetchone()
+        if not res or res[0] != self.inputs_hash:
+            self.db.execute("DELETE FROM lemmas")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('inputs_hash', ?)", (self.inputs_hash,))
+            self.db.commit()
+
+    def get(self, form, filter_word, filter_pos):
+        """ Returns a list of (lemma, pos, index) or None if the item is not cached """
+        key = (form, filter_word or "", filter_pos or "")
+        data = self._pending.get(key)
+        if data is None:
+            if self._stale:
+                return None
+            res = self.db.execute("SELECT lemmas FROM lemmas WHERE form=? AND filter_word=? AND filter_pos=?", key).fetchone()
+            if res is None:
+                return None
+            data = res[0]
+        return [tuple(item) for item in json.loads(data)]
+
+    def set(self, form, filter_word, filter_pos, lemmas):
+        self._pending[(form, filter_word or "", filter_pos or "")] = json.dumps(lemmas)
+        if len(self._pending) >= self._commit_interval:
+            self.flush()
+
+    def pop_pending(self):
+        """ Returns and clears the items set since the last call, as a list of (key, data) """
+        pending = list(self._pending.items())
+        self._pending = {}
+        return pending
+
+    def add_pending(self, items):
+        """ Adds items returned by pop_pending() of a read_only cache """
+        self._pending.update(items)
+        if len(self._pending) >= self._commit_interval:
+            self.flush()
+
+    def flush(self):
+        if not self._pending or self.read_only:
+            return
+        self.db.executemany("INSERT OR REPLACE INTO lemmas VALUES (?, ?, ?, ?)",
+                [(*key, data) for key, data in self._pending.items()])
+        self.db.commit()
+        self._pending = {}
+
+    def close(self):
+        self.flush()
+        self.db.close()
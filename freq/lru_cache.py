@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+from collections import OrderedDict
+
+class LRUCache():
+    """
+    Bounded mapping that discards the least recently used items once it holds
+    more than maxsize items, counting hits, misses and evictions
+    """
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop_counters(self):
+        """ Returns (hits, misses, evictions) since the last call and resets them, see add_counters() """
+        counters = (self.hits, self.misses, self.evictions)
+        self.hits = self.misses = self.evictions = 0
+        return counters
+
+    def add_counters(self, counters):
+        """ Adds the pop_counters() of another cache, such as a pool worker's copy """
+        hits, misses, evictions = counters
+        self.hits += hits
+        self.misses += misses
+        self.evictions += evictions
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits/lookups if lookups else 0,
+        }
+
+    def format_stats(self, name):
+        stats = self.get_stats()
+        return f"{name}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate), " \
+               f"{stats['evictions']} evictions, {stats['size']}/{stats['maxsize']} entries"
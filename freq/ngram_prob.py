@@ -15,15 +15,131 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import mmap
+import struct
 import sys
 
+from array import array
+
+class StringList():
+    """
+    Read-only list of str backed by a compiled string table
+    strings - buffer containing the UTF-8 encoded strings, concatenated
+    offsets - array of len(strings)+1 offsets into strings
+    index - array mapping list positions to string numbers, or None
+    """
+
+    def __init__(self, strings, offsets, index=None):
+        self._strings = strings
+        self._offsets = offsets
+        self._index = index
+
+    def __getitem__(self, i):
+        if self._index is not None:
+            i = self._index[i]
+        return bytes(self._strings[self._offsets[i]:self._offsets[i+1]]).decode()
+
+    def __len__(self):
+        return len(self._index) if self._index is not None else len(self._offsets)-1
+
+class SortedStringTable():
+    """
+    Read-only mapping of str -> int backed by a compiled string table
+    strings - buffer containing the UTF-8 encoded keys, concatenated
+    offsets - array of len(keys)+1 offsets into strings
+    order - array of row numbers, sorted by key, or None if the rows are already sorted
+    values - array of values, indexed by row, or None to return the row number
+    """
+
+    def __init__(self, strings, offsets, order=None, values=None):
+        self._strings = strings
+        self._offsets = offsets
+        self._order = order
+        self._values = values
+        self._len = len(offsets)-1
+
+    def _key(self, row):
+        return bytes(self._strings[self._offsets[row]:self._offsets[row+1]])
+
+    def _find(self, key):
+        target = key.encode()
+        lo = 0
+        hi = self._len
+        while lo < hi:
+            mid = (lo+hi)//2
+            row = self._order[mid] if self._order is not None else mid
+            found = self._key(row)
+            if found < target:
+                lo = mid+1
+            elif found > target:
+                hi = mid
+            else:
+                return row
+
+    def get(self, key, default=None):
+        row = self._find(key)
+        if row is None:
+            return default
+        return self._values[row] if self._values is not None else row
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        """ Yields keys in row order """
+        for row in range(self._len):
+            yield self._key(row).decode()
+
 class NgramPosProbability():
 
+    # Header of a compiled file, followed by the 8-byte aligned sections
+    # described in save()
+    _MAGIC = b"NGPROBS\x03"
+    _HEADER = struct.Struct("<8sIIIIQQQ")
+
     def __init__(self, probfile, caseprobfile=None):
-        self.form_probs = {}
-        self._preferred_case = {} # lazy loaded
-        self._caseprobfile = caseprobfile
-        self._case_prob = {} # lazy loaded
+
+        # lowercase form -> preferred case, only for forms whose preferred case isn't lowercase
+        self._preferred_case = {}
+
+        # form -> case count, None if no case data was provided
+        self._case_prob = None
+
+        with open(probfile, "rb") as infile:
+            magic = infile.read(len(self._MAGIC))
+        compiled = magic == self._MAGIC
+        if not compiled and magic.startswith(self._MAGIC[:-1]):
+            raise ValueError(f"{probfile} was compiled by an older version, recompile it")
+        if compiled:
+            self._load_compiled(probfile)
+        else:
+            self._load(probfile)
+
+        if self._case_prob is None and caseprobfile:
+            self._case_prob = self._read_case_prob(caseprobfile)
+
+    def _load(self, probfile):
+
+        # Each line is parsed once into fixed-width integer arrays:
+        #   _rows       form -> row number
+        #   _totals     total usage count of the form
+        #   _pos_totals sum of the counts of all recognized POS tags
+        #   _first_pos  column of the first recognized POS tag listed, -1 if none
+        #   _has_pos    0 if the line has no POS data at all
+        #   _counts     row-major matrix, _num_pos columns per row, -1 if the tag isn't listed
+        self._rows = {}
+        self._totals = array("q")
+        self._pos_totals = array("q")
+        self._first_pos = array("b")
+        self._has_pos = bytearray()
+        self._counts = array("q")
+
+        # Note: this assumes that the prob file is sorted from most common to least common
+        # so that the first case variation of a form is the preferred case
+        preferred_case = {}
 
         with open(probfile) as infile:
             for line in infile:
@@ -31,7 +147,17 @@ class NgramPosProbability():
                 if not line:
                     continue
                 form, _, totalpos = line.partition("\t")
-                self.form_probs[form] = totalpos
+                # Lines without a usage count never returned any data, skip them
+                if not totalpos.partition("\t")[0].strip().isdigit():
+                    continue
+                self._add_row(form, totalpos)
+
+                lc = form.lower()
+                if lc not in preferred_case:
+                    # always prefer lowercase of single letters
+                    preferred_case[lc] = lc if len(form) == 1 else form
+
+        self._preferred_case = {lc: form for lc, form in preferred_case.items() if lc != form}
 
     _tag_to_pos = {
         "ADP": 'prep',
@@ -45,137 +171,306 @@ class NgramPosProbability():
         "PRT": 'part',
         "VERB": 'v',
     }
+    _all_pos = list(_tag_to_pos.values())
+    _num_pos = len(_all_pos)
+    _tag_to_col = {tag: col for col, tag in enumerate(_tag_to_pos)}
+    _pos_to_col = {pos: col for col, pos in enumerate(_all_pos)}
+
     @classmethod
     def tag_to_pos(cls, tag):
         return cls._tag_to_pos.get(tag)
 
-    def get_usage_count(self, word, pos=None):
+    def _add_row(self, form, totalpos):
+        total, _, all_pos = totalpos.partition("\t")
 
-        totalpos = self.form_probs.get(word, None)
-        if not totalpos:
-            return 0
+        counts = [-1] * self._num_pos
+        first_pos = -1
+        pos_total = 0
+        if all_pos:
+            for tagcount in all_pos.split("; "):
+                tag, _, count = tagcount.partition(":")
+                col = self._tag_to_col.get(tag)
+                if col is None:
+                    continue
+                if first_pos < 0:
+                    first_pos = col
+                count = int(count)
+                pos_total += count
+                counts[col] = count
+
+        row = self._rows.get(form)
+        if row is None:
+            row = len(self._totals)
+            self._rows[form] = row
+            self._totals.append(int(total))
+            self._pos_totals.append(pos_total)
+            self._first_pos.append(first_pos)
+            self._has_pos.append(bool(all_pos))
+            self._counts.extend(counts)
+        else:
+            # Duplicate forms replace the earlier data
+            self._totals[row] = int(total)
+            self._pos_totals[row] = pos_total
+            self._first_pos[row] = first_pos
+            self._has_pos[row] = bool(all_pos)
+            offset = row * self._num_pos
+            self._counts[offset:offset+self._num_pos] = array("q", counts)
 
-        total, _, all_pos = totalpos.partition("\t")
-        if not all_pos:
+    def get_usage_count(self, word, pos=None):
+
+        row = self._rows.get(word)
+        if row is None or not self._has_pos[row]:
             return 0
 
-        total = int(total)
+        total = self._totals[row]
         if not pos:
             return total
 
-        data = self.get_pos_probs(word)
-        if not data:
+        pos_total = self._pos_totals[row]
+        if not pos_total:
             return 0
 
-        return int(data.get(pos, 0) * total)
+        col = self._pos_to_col.get(pos)
+        if col is None:
+            return 0
 
-    def get_data(self, word):
+        count = self._counts[row * self._num_pos + col]
+        if count <= 0:
+            return 0
 
-        totalpos = self.form_probs.get(word, None)
-        if not totalpos:
-            return None, {}
+        return int(round(count/pos_total, 4) * total)
 
-        total, _, all_pos = totalpos.partition("\t")
-        total = int(total)
-        if not all_pos:
-            return total, {}
+    def get_usage_counts(self, words, pos_list):
+        """
+        Returns get_usage_count(word, pos) for every word in words and every pos in pos_list
+        as a flat array of len(words)*len(pos_list) counts in row-major order
+        """
 
-        pos_count = {}
-        pos_total = 0
-        for tagcount in all_pos.split("; "):
-            tag, _, count = tagcount.partition(":")
-            pos = self.tag_to_pos(tag)
+        num_pos = self._num_pos
+        cols = [self._pos_to_col.get(pos, -1) if pos else None for pos in pos_list]
+        width = len(cols)
 
-            if not pos:
+        res = array("q", [0]) * (len(words)*width)
+        for i, word in enumerate(words):
+            row = self._rows.get(word)
+            if row is None or not self._has_pos[row]:
                 continue
 
-            count = int(count)
-            pos_total += count
-            pos_count[pos] = count
+            total = self._totals[row]
+            pos_total = self._pos_totals[row]
+            offset = row * num_pos
+            for j, col in enumerate(cols):
+                if col is None:
+                    res[i*width+j] = total
+                elif col >= 0 and pos_total:
+                    count = self._counts[offset + col]
+                    if count > 0:
+                        res[i*width+j] = int(round(count/pos_total, 4) * total)
+
+        return res
+
+    def get_pos_prob_matrix(self, words):
+        """
+        Returns the unfiltered get_pos_probs() values of every word in words
+        as a flat array of len(words)*len(_all_pos) probabilities in row-major order
+        Columns are ordered by _all_pos, unlisted tags and unknown words are 0
+        """
+
+        num_pos = self._num_pos
+        res = array("d", [0]) * (len(words)*num_pos)
+        for i, word in enumerate(words):
+            row = self._rows.get(word)
+            if row is None:
+                continue
+
+            pos_total = self._pos_totals[row]
+            if not pos_total:
+                continue
+
+            offset = row * num_pos
+            for col in range(num_pos):
+                count = self._counts[offset + col]
+                if count > 0:
+                    res[i*num_pos+col] = round(count/pos_total, 4)
+
+        return res
+
+    def get_data(self, word):
+
+        row = self._rows.get(word)
+        if row is None:
+            return None, {}
+
+        total = self._totals[row]
+        offset = row * self._num_pos
+        pos_count = {}
+        for col, pos in enumerate(self._all_pos):
+            count = self._counts[offset + col]
+            if count >= 0:
+                pos_count[pos] = count
 
         return total, pos_count
 
     def get_preferred_pos(self, word):
-        totalpos = self.form_probs.get(word, None)
-        if not totalpos:
+        row = self._rows.get(word)
+        if row is None:
             return
 
-        total, _, all_pos = totalpos.partition("\t")
-        if not all_pos:
+        col = self._first_pos[row]
+        if col < 0:
             return
 
-        for tagcount in all_pos.split("; "):
-            tag, _, count = tagcount.partition(":")
-            pos = self.tag_to_pos(tag)
-
-            if not pos:
-                continue
-
-            return pos
+        return self._all_pos[col]
 
     def get_pos_probs(self, word, filter_pos=None):
 
-        totalpos = self.form_probs.get(word, None)
-        if not totalpos:
-            return
-
-        total, _, all_pos = totalpos.partition("\t")
-        if not all_pos:
+        row = self._rows.get(word)
+        if row is None:
             return
 
+        offset = row * self._num_pos
         pos_total = 0
         pos_count = {}
-        for tagcount in all_pos.split("; "):
-            tag, _, count = tagcount.partition(":")
-            pos = self.tag_to_pos(tag)
-
-            if not pos:
+        for col, pos in enumerate(self._all_pos):
+            count = self._counts[offset + col]
+            if count < 0:
                 continue
 
             if filter_pos and pos not in filter_pos:
-#                if not pos_total:
-#                    print(word, all_pos, filter_pos, file=sys.stderr)
                 continue
 
-            count = int(count)
             pos_total += count
             pos_count[pos] = count
 
         if pos_total == 0:
-#            print("failed", word, filter_pos, file=sys.stderr)
             return
 
         return {k: round(count/pos_total, 4) for k, count in sorted(pos_count.items(), key=lambda x: (x[1]*-1, x[0]))}
 
     def get_preferred_case(self, word):
-        if not self._preferred_case:
-            self._build_preferred_case()
-        return self._preferred_case.get(word.lower(), word.lower())
+        lc = word.lower()
+        return self._preferred_case.get(lc, lc)
 
     def get_case_prob(self, word):
-        if not self._preferred_case:
-            self._load_case_prob()
-        return self._case_prob.get(word, 0)
-
-    def _load_case_prob(self):
-        if self._case_prob:
-            raise ValueError("already initialized")
-
-        if not self._caseprobfile:
+        if self._case_prob is None:
             raise ValueError("caseprobfile not specified when creating NgramPosProbability()")
+        return self._case_prob.get(word, 0)
 
-        with open(self._caseprobfile) as infile:
-            self._case_prob = {k:int(v) for line in infile for k,v in line.strip().split("\t")}
-
-    def _build_preferred_case(self):
-        if self._preferred_case:
-            raise ValueError("already initialized")
-
-        # Note: this assumes that the prob file is sorted from most common to least common
-        for key, tagcount in self.form_probs.items():
-            lc = key.lower()
-            # always prefer lowercase of single letters
-            if len(key) == 1:
-                key = lc
-            if lc not in self._preferred_case:
-                self._preferred_case[lc] = key
+    @staticmethod
+    def _read_case_prob(filename):
+        case_prob = {}
+        with open(filename) as infile:
+            for line in infile:
+                line = line.strip()
+                if not line:
+                    continue
+                form, _, count = line.partition("\t")
+                case_prob[form] = int(count)
+        return case_prob
+
+    def save(self, filename):
+        """
+        Writes the loaded data, the preferred case index and the case probability data to a
+        compiled file that can be passed to NgramPosProbability() as the probfile.
+        Compiled files are memory mapped and searched in place, so they load
+        in constant time and are shared between processes by the page cache.
+
+        Sections, in native byte order, each padded to 8 bytes:
+          offsets       uint64 x rows+1     offsets of each form in strings
+          order         uint32 x rows       row numbers sorted by form
+          totals        int64 x rows
+          pos_totals    int64 x rows
+          counts        int64 x rows*num_pos
+          first_pos     int8 x rows
+          has_pos       uint8 x rows
+          strings       UTF-8 forms, in row order
+          case_offsets  uint64 x case_rows+1
+          case_counts   int64 x case_rows
+          case_strings  UTF-8 forms, sorted
+          pc_offsets    uint64 x pc_rows+1
+          pc_forms      uint32 x pc_rows    row number of the preferred case form
+          pc_strings    UTF-8 lowercase forms, sorted
+        """
+
+        if hasattr(self, "_mmap"):
+            raise ValueError("cannot save a compiled NgramPosProbability")
+
+        forms = [form.encode() for form in self._rows]
+        order = array("I", sorted(range(len(forms)), key=lambda row: forms[row]))
+        offsets, strings = self._pack_strings(forms)
+
+        case_items = sorted((form.encode(), count) for form, count in (self._case_prob or {}).items())
+        case_offsets, case_strings = self._pack_strings([form for form, _ in case_items])
+        case_counts = array("q", [count for _, count in case_items])
+
+        pc_items = sorted((lc.encode(), self._rows[form]) for lc, form in self._preferred_case.items())
+        pc_offsets, pc_strings = self._pack_strings([lc for lc, _ in pc_items])
+        pc_forms = array("I", [row for _, row in pc_items])
+
+        sections = [
+            offsets.tobytes(),
+            order.tobytes(),
+            array("q", self._totals).tobytes(),
+            array("q", self._pos_totals).tobytes(),
+            array("q", self._counts).tobytes(),
+            array("b", self._first_pos).tobytes(),
+            bytes(self._has_pos),
+            strings,
+            case_offsets.tobytes(),
+            case_counts.tobytes(),
+            case_strings,
+            pc_offsets.tobytes(),
+            pc_forms.tobytes(),
+            pc_strings,
+        ]
+
+        with open(filename, "wb") as outfile:
+            outfile.write(self._HEADER.pack(self._MAGIC, self._num_pos, len(forms), len(case_items), len(pc_items),
+                    len(strings), len(case_strings), len(pc_strings)))
+            for data in sections:
+                outfile.write(data)
+                outfile.write(bytes(-len(data) % 8))
+
+    @staticmethod
+    def _pack_strings(items):
+        offsets = array("Q", [0])
+        for item in items:
+            offsets.append(offsets[-1] + len(item))
+        return offsets, b"".join(items)
+
+    def _load_compiled(self, filename):
+        with open(filename, "rb") as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, num_pos, rows, case_rows, pc_rows, strings_len, case_strings_len, pc_strings_len = self._HEADER.unpack_from(self._mmap)
+        if num_pos != self._num_pos:
+            raise ValueError(f"{filename} was compiled with {num_pos} POS columns, expected {self._num_pos}")
+
+        view = memoryview(self._mmap)
+        pos = self._HEADER.size
+
+        def section(size, fmt=None):
+            nonlocal pos
+            data = view[pos:pos+size]
+            pos += size + (-size % 8)
+            return data.cast(fmt) if fmt else data
+
+        offsets = section((rows+1)*8, "Q")
+        order = section(rows*4, "I")
+        self._totals = section(rows*8, "q")
+        self._pos_totals = section(rows*8, "q")
+        self._counts = section(rows*num_pos*8, "q")
+        self._first_pos = section(rows, "b")
+        self._has_pos = section(rows, "B")
+        strings = section(strings_len)
+        case_offsets = section((case_rows+1)*8, "Q")
+        case_counts = section(case_rows*8, "q")
+        case_strings = section(case_strings_len)
+        pc_offsets = section((pc_rows+1)*8, "Q")
+        pc_forms = section(pc_rows*4, "I")
+        pc_strings = section(pc_strings_len)
+
+        self._rows = SortedStringTable(strings, offsets, order)
+        self._preferred_case = SortedStringTable(pc_strings, pc_offsets, None, StringList(strings, offsets, pc_forms))
+        if case_rows:
+            self._case_prob = SortedStringTable(case_strings, case_offsets, None, case_counts)
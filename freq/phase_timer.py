@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+import json
+import time
+
+from collections import defaultdict
+
+class PhaseTimer():
+    """
+    Records the wall time and number of calls of wrapped methods, grouped by phase,
+    along with any other counters
+
+    Times are inclusive, a phase that calls another wrapped method includes its time
+    """
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._start = time.perf_counter()
+
+    def wrap(self, obj, method, phase=None):
+        """ Replaces obj.method with a wrapper that records its time under phase (defaults to the method name) """
+
+        phase = phase if phase else method
+        original = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds[phase] += time.perf_counter() - start
+                self.calls[phase] += 1
+
+        setattr(obj, method, timed)
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def get_report(self):
+        return {
+            "total_seconds": round(time.perf_counter() - self._start, 6),
+            "phases": {phase: {"calls": self.calls[phase], "seconds": round(self.seconds[phase], 6)} for phase in sorted(self.calls)},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def save(self, filename):
+        with open(filename, "w") as outfile:
+            json.dump(self.get_report(), outfile, indent=2)
+            outfile.write("\n")
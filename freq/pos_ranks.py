@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+import sys
+
+from collections import defaultdict
+
+from .lemma_cache import stat_files
+
+class PosRanks():
+    """
+    Precomputed FrequencyList.get_ranked_pos() results for every form in AllForms
+
+    Each form is stored with the sorted list of parts of speech of its lemmas in AllForms
+    and the (pos, count) ranking for that list. A lookup only matches if it asks for the
+    same list of parts of speech, anything else falls back to the live computation
+
+    The table is tied to its input files (ngprobs, allforms), if any of them has been
+    modified, the table is ignored (see stat_files)
+    """
+
+    # Increment when changes to FrequencyList.get_ranked_pos would change the rankings
+    VERSION = 1
+
+    def __init__(self, filename=None, input_files=[]):
+        self.ranks = {}
+        self.inputs_hash = stat_files(input_files, f"PosRanks {self.VERSION}")
+
+        if filename:
+            self.load(filename)
+
+    def get(self, form, all_pos):
+        """ Returns the get_ranked_pos() list of (form, pos, count) or None if it isn't in the table """
+        item = self.ranks.get(form)
+        if item is None or item[0] != tuple(all_pos):
+            return None
+        return [(form, pos, count) for pos, count in item[1]]
+
+    def __len__(self):
+        return len(self.ranks)
+
+    @staticmethod
+    def get_form_pos(allforms, form):
+        """ Returns the sorted parts of speech of the lemmas of form, with participles treated as verbs """
+        return tuple(sorted({"v" if pos == "part" else pos for pos in allforms.get_form_pos(form)}))
+
+    def build(self, allforms, ngprobs):
+        """
+        Ranks every form in allforms, forms with the same parts of speech are looked
+        up together in a single get_usage_counts() call
+        """
+
+        by_pos = defaultdict(list)
+        seen = set()
+        for form, _, _ in allforms.all:
+            if form in seen:
+                continue
+            seen.add(form)
+
+            all_pos = self.get_form_pos(allforms, form)
+            # get_ranked_pos handles these without looking at the usage counts
+            if len(all_pos) < 2 or "num" in all_pos:
+                continue
+            by_pos[all_pos].append(form)
+
+        for all_pos, forms in by_pos.items():
+            width = len(all_pos)
+            counts = ngprobs.get_usage_counts(forms, all_pos)
+            for i, form in enumerate(forms):
+                row = counts[i*width:(i+1)*width]
+                # all_pos is sorted, so a stable sort by count matches get_ranked_pos
+                ranked = sorted(range(width), key=row.__getitem__, reverse=True)
+                self.ranks[form] = (all_pos, tuple((all_pos[j], row[j]) for j in ranked))
+
+    def load(self, filename):
+        with open(filename) as infile:
+            header = next(infile, "").rstrip("\n")
+            if header != f"#inputs_hash\t{self.inputs_hash}":
+                print(f"{filename} was built from different input files, ignoring", file=sys.stderr)
+                return
+
+            for line in infile:
+                form, all_pos, ranked = line.rstrip("\n").split("\t")
+                items = []
+                for item in ranked.split(","):
+                    pos, _, count = item.partition(":")
+                    items.append((pos, int(count)))
+                self.ranks[form] = (tuple(all_pos.split(",")), tuple(items))
+
+    def save(self, filename):
+        with open(filename, "w") as outfile:
+            outfile.write(f"#inputs_hash\t{self.inputs_hash}\n")
+            for form, (all_pos, ranked) in sorted(self.ranks.items()):
+                outfile.write(f"{form}\t{','.join(all_pos)}\t{','.join(f'{pos}:{count}' for pos, count in ranked)}\n")
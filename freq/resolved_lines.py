@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+
+import json
+import os
+
+from .lemma_cache import stat_files
+
+class ResolvedLines():
+    """
+    Sidecar file with the FrequencyList.resolve_line() results of a previous run,
+    used by FrequencyList.find_lemmas to only resolve lines that have changed
+
+    Each line is stored with a fingerprint of the line and of the dictionary entries
+    it depends on (see FrequencyList.get_line_fingerprint)
+
+    context_files are files that affect every line (ngram data), if any of them is
+    modified, all of the previous results are discarded (see stat_files)
+    """
+
+    # Increment when changes to FrequencyList would change the resolved lines
+    VERSION = 1
+
+    def __init__(self, filename, context_files=[]):
+        self.filename = filename
+        self.context = stat_files(context_files, f"ResolvedLines {self.VERSION}")
+        self.previous = {}
+        self.current = {}
+        self.reused = 0
+        self.recomputed = 0
+
+        if os.path.exists(filename):
+            with open(filename) as infile:
+                data = json.load(infile)
+            if data.get("context") == self.context:
+                self.previous = data["lines"]
+
+    @staticmethod
+    def get_key(linenum, line):
+        """ Lines without a count are assigned a count based on their position, so include it in the key """
+        line = line.strip()
+        form, *splits = line.split("\t")
+        return line if splits and splits[0] else f"{linenum}:{line}"
+
+    def get(self, key):
+        """ Returns (fingerprint, exported resolve_line() result) or None """
+        return self.previous.get(key)
+
+    def set(self, key, fingerprint, item):
+        self.current[key] = (fingerprint, item)
+
+    def save(self):
+        with open(self.filename, "w") as outfile:
+            json.dump({"context": self.context, "lines": self.current}, outfile, ensure_ascii=False)
@@ -1,2 +1,3 @@
 from .sentences import *
-from .sentence_builder import SentenceBuilder
+from .sentence_builder import SentenceBuilder, init_worker
+from .tag_cache import TagCache
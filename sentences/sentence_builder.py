@@ -1,19 +1,49 @@
 #!/usr/bin/python3
 
 import ijson
+import json
+import os
 import re
 import string
+import time
 
 import sys
 
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
+
+from spanish_tools.freq.lemma_cache import stat_files
+from spanish_tools.freq.lru_cache import LRUCache
 
 Phrase = namedtuple("Phrase", [ "form", "lemma", "start", "end" ])
 Sentence = namedtuple("Sentence", [ "english", "spanish", "credits", "eng_id", "eng_user", "eng_score", "spa_id", "spa_user", "spa_score" ])
 
+# SentenceBuilder used by worker processes, see init_worker()
+_worker_builder = None
+
+def init_worker(factory, *args):
+    """
+    multiprocessing.Pool initializer for SentenceBuilder.print_tagged_data(pool=)
+    factory(*args) must return a SentenceBuilder, it is called once in each worker process
+    """
+    global _worker_builder
+    _worker_builder = factory(*args)
+
+def tag_batch(batch):
+    return _worker_builder.tag_sentences(batch), _worker_builder.freq.pop_worker_state()
+
 class SentenceBuilder():
 
-    def __init__(self, allforms, freq, ngramdb, word_min=5, word_max=15, ignored_phrases=[]):
+    # Increment when changes to make_all_phrases would change the cached phrase table
+    PHRASES_VERSION = 1
+
+    def __init__(self, allforms, freq, ngramdb, word_min=5, word_max=15, ignored_phrases=[], phrase_cache=None, phrase_inputs=[],
+            tag_memo_size=0):
+        """
+        phrase_cache - if provided, the phrase table is saved to this file and reused by later runs
+        phrase_inputs - the files the phrase table is built from (dictionary, allforms, ngram data),
+                        the cached table is rebuilt if any of them is modified
+        tag_memo_size - if provided, keep up to N tag_to_pos() results in memory
+        """
         self.allforms = allforms
         self.freq = freq
         self.ngramdb = ngramdb
@@ -25,7 +55,25 @@ class SentenceBuilder():
         self.ignored_phrases = ["a la", "lo que", "el que"]
 
         self.detected_phrases = defaultdict(int)
-        self.all_phrases = self.make_all_phrases()
+        self.tag_memo = LRUCache(tag_memo_size) if tag_memo_size else None
+
+        # Built on first use, see all_phrases and phrase_trie
+        self.phrase_cache = phrase_cache
+        self.phrase_inputs = phrase_inputs
+        self._all_phrases = None
+        self._phrase_trie = None
+
+    @property
+    def all_phrases(self):
+        if self._all_phrases is None:
+            self._all_phrases = self.load_all_phrases()
+        return self._all_phrases
+
+    @property
+    def phrase_trie(self):
+        if self._phrase_trie is None:
+            self._phrase_trie = self.make_phrase_trie(self.all_phrases)
+        return self._phrase_trie
 
 
     def get_most_common_lemma(self, lemmas):
@@ -50,6 +98,40 @@ class SentenceBuilder():
 
         return scores[0][1]
 
+    def load_all_phrases(self):
+        """ Returns the phrase table from phrase_cache if it was built from the same inputs, otherwise builds it """
+
+        if not self.phrase_cache:
+            return self.make_all_phrases()
+
+        inputs_hash = stat_files(self.phrase_inputs, f"SentenceBuilder {self.PHRASES_VERSION} {self.ignored_phrases}")
+        if os.path.exists(self.phrase_cache):
+            with open(self.phrase_cache) as infile:
+                data = json.load(infile)
+            if data.get("inputs_hash") == inputs_hash:
+                return self.import_phrases(data)
+
+        all_phrases = self.make_all_phrases()
+        with open(self.phrase_cache, "w") as outfile:
+            json.dump(self.export_phrases(all_phrases, inputs_hash), outfile, ensure_ascii=False)
+        return all_phrases
+
+    @staticmethod
+    def export_phrases(all_phrases, inputs_hash):
+        return {
+            "inputs_hash": inputs_hash,
+            "alt_case": all_phrases["alt_case"],
+            "sizes": {str(size): phrases for size, phrases in all_phrases.items() if size != "alt_case"},
+        }
+
+    @staticmethod
+    def import_phrases(data):
+        all_phrases = {}
+        all_phrases["alt_case"] = defaultdict(list, data["alt_case"])
+        for size, phrases in data["sizes"].items():
+            all_phrases[int(size)] = defaultdict(list, phrases)
+        return all_phrases
+
     def make_all_phrases(self):
         all_phrases = {}
         all_phrases["alt_case"] = defaultdict(list)
@@ -81,6 +163,33 @@ class SentenceBuilder():
 #        print("alt case", len(all_phrases["alt_case"]), file=sys.stderr)
         return all_phrases
 
+    @staticmethod
+    def make_phrase_trie(all_phrases):
+        """
+        Returns a word level trie of the phrases in all_phrases
+        Each node is a dict of word -> child node, and nodes that complete a phrase
+        also store (form, lemma) under the None key
+        """
+
+        trie = {}
+        for size, phrases in all_phrases.items():
+            if size == "alt_case":
+                continue
+
+            for form, lemma in phrases.items():
+                # Sentences are matched a word at a time, so phrases with irregular
+                # whitespace can never match and are skipped
+                words = form.split(" ")
+                if len(words) != size or not lemma:
+                    continue
+
+                node = trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                node[None] = (form, lemma)
+
+        return trie
+
     def matches_c12n(self, phrase, case_words):
         # Verify that words with capitalization have matching capitalization
         # words that are uppercase in the phrase must match case in the sentence
@@ -116,47 +225,38 @@ class SentenceBuilder():
 
         phrases = []
 
+        # Walk the phrase trie from each word, keeping only the longest phrase that
+        # matches case at each start and isn't embedded in a phrase that starts earlier
+        max_end = 0
         for start in range(end-1):
-            for size in range(2,end-start+1):
-
-                end = start+size
-                sentence_phrase = " ".join(words[start:end])
-
-                lemma = self.all_phrases.get(size, {}).get(sentence_phrase)
-                if lemma:
-                    if self.matches_c12n(sentence_phrase, case_words[start:end]):
-                        phrases.append(Phrase(sentence_phrase,lemma,start,end))
+            matches = []
+            node = self.phrase_trie
+            for word_end in range(start, end):
+                node = node.get(words[word_end])
+                if node is None:
+                    break
+                if None in node:
+                    matches.append((word_end+1, node[None]))
 
+            for phrase_end, (form, lemma) in reversed(matches):
+                if phrase_end <= max_end:
+                    break
+                if self.matches_c12n(form, case_words[start:phrase_end]):
+                    phrases.append(Phrase(form, lemma, start, phrase_end))
+                    max_end = phrase_end
+                    break
 
-        # Detect phrases that are embedded within a larger phrase
         phrases.sort(key=lambda x: ((x.end-x.start)*-1, x.start))
-        to_remove = set()
-        for x in range(1, len(phrases)):
-            small_phrase = phrases[x]
-            for big_phrase in phrases[0:x]:
-                if small_phrase.start >= big_phrase.start and small_phrase.end <= big_phrase.end:
-                    to_remove.add(x)
-
-
-#        if len(to_remove):
-#            print("removing", sentence, phrases, to_remove, file=sys.stderr)
-#        elif len(phrases)>2:
-#            print(sentence, phrases, file=sys.stderr)
-
-        # Remove embedded phrases
-        for x in sorted(to_remove, reverse=True):
-    #        print("del", x, len(phrases))
-            del phrases[x]
-
 
         # Convert word offsets to character offsets
+        # word_ends[i] is the length of the first i words joined by spaces
+        word_ends = [0]
+        for i, word in enumerate(orig_words):
+            word_ends.append(word_ends[-1] + len(word) + (1 if i else 0))
+
         char_offset_phrases = []
         for phrase in phrases:
-            start_word = phrase.start
-            end_word = phrase.end
-            start_char = len(" ".join(orig_words[:start_word]))
-            end_char = len(" ".join(orig_words[:end_word]))
-            char_offset_phrases.append(Phrase(phrase.form, phrase.lemma, start_char, end_char))
+            char_offset_phrases.append(Phrase(phrase.form, phrase.lemma, word_ends[phrase.start], word_ends[phrase.end]))
 
             self.detected_phrases[phrase.lemma] += 1
 
@@ -168,6 +268,24 @@ class SentenceBuilder():
 
 
     def tag_to_pos(self, tag, word, is_phrase):
+        """
+        Returns a tuple of (pos, wordtag) items for a freeling token
+        The result only depends on word, the token's lemma and ctag and is_phrase, so it is memoized by those
+        """
+
+        if self.tag_memo is None:
+            return self.resolve_tag_pos(tag, word, is_phrase)
+
+        key = (word, tag["lemma"], tag["ctag"], is_phrase)
+        pos_tags = self.tag_memo.get(key)
+        if pos_tags is None:
+            pos_tags = self.resolve_tag_pos(tag, word, is_phrase)
+            self.tag_memo.set(key, pos_tags)
+
+        return pos_tags
+
+    def resolve_tag_pos(self, tag, word, is_phrase):
+        """ tag_to_pos() without the memo """
 
         lemma = tag["lemma"]
         ctag = tag["ctag"]
@@ -198,7 +316,7 @@ class SentenceBuilder():
             pos = "num"
             lemma = word
         if not pos:
-            return []
+            return ()
 
         # let nouns be proper nouns if they start with an uppercase and most commonly occurr with the uppercase
         if pos == "n" and word[0].isupper() and self.freq.ngprobs.get_preferred_case(word.lower()) == word:
@@ -239,19 +357,19 @@ class SentenceBuilder():
             verb_lemma = self.get_lemmas(word, "part")
             if verb_lemma == word:
                 # no verb
-                return [("part-adj", adj_res)]
+                return (("part-adj", adj_res),)
 
             verb_res = f"{word}|{verb_lemma}"
             # NOTE: part-verb doesn't match "v", but this is intentional
-            return [("part-adj", adj_res), ("part-verb", verb_res)]
+            return (("part-adj", adj_res), ("part-verb", verb_res))
 
         if is_phrase:
             pos = "phrase-" + pos
 
         if word != lemma:
-            return [(pos, f"{word}|{lemma}")]
+            return ((pos, f"{word}|{lemma}"),)
 
-        return [(pos, word)]
+        return ((pos, word),)
 
     @staticmethod
     def group_tags(pos_tags):
@@ -446,42 +564,137 @@ class SentenceBuilder():
         word = sentence[start:end+1]
         return word
 
-    def print_tagged_data(self, sentence_filename, tag_filename, include_verb_rank=False, verbose=False):
+    def print_tagged_data(self, sentence_filename, tag_filename, include_verb_rank=False, verbose=False, pool=None, batch_size=100, tag_cache=None,
+            max_pending=16):
+        """
+        If pool is specified, the sentences are tagged in batches by the worker processes
+        (see init_worker) and printed in input order, with at most max_pending batches in flight
+        If tag_cache (a TagCache) is specified, sentences that haven't changed since the previous
+        run reuse their stored tags, and the tags of the current run are stored in tag_cache
+        """
         tags_iter = self.iter_tags(tag_filename)
         sentence_iter = self.iter_sentences(sentence_filename)
 
-        tagdata = {}
-        seen = set()
-
+        start = time.perf_counter()
         count = 0
-        for sentence, tag_data in zip(sentence_iter, tags_iter):
+        for sentence, (tag_str, verb_rank) in self.iter_tagged(zip(sentence_iter, tags_iter), include_verb_rank, pool, batch_size, tag_cache, max_pending):
             count += 1
             if not count % 1000 and verbose:
-                print(count, end="\r", file=sys.stderr)
+                elapsed = time.perf_counter() - start
+                print(f"{count} ({count/elapsed:.0f} sentences/s)", end="\r", file=sys.stderr)
+
+            print(self.format_tagged_sentence(sentence, tag_str, verb_rank, include_verb_rank))
+
+    def iter_tagged(self, items, include_verb_rank=False, pool=None, batch_size=100, tag_cache=None, max_pending=16):
+        """
+        Yields (sentence, (tag_str, verb_rank)) for every (sentence, tag_data) in items, in input order
+        Only sentences that aren't in tag_cache are tagged, by the pool workers if pool is specified
+        """
+
+        # The sentences of each batch along with their fingerprint and stored tags,
+        # in the same order as the results of the batches
+        pending = deque()
+
+        def iter_batches():
+            for batch in self.iter_batches(items, batch_size):
+                keyed = []
+                to_tag = []
+                for sentence, tag_data in batch:
+                    fingerprint = None
+                    cached = None
+                    if tag_cache:
+                        fingerprint = tag_cache.get_fingerprint(sentence.spanish, tag_data)
+                        cached = tag_cache.get(sentence.spa_id, fingerprint)
+                        if cached and include_verb_rank and cached[1] is None:
+                            cached = None
+                    if not cached:
+                        to_tag.append((sentence, tag_data, include_verb_rank))
+                    keyed.append((sentence, fingerprint, cached))
+                pending.append(keyed)
+                yield to_tag
+
+        if pool:
+            results = self.iter_pool_results(pool, iter_batches(), max_pending)
+        else:
+            results = ((self.tag_sentences(batch), None) for batch in iter_batches())
+
+        for tagged, worker_state in results:
+            if worker_state:
+                self.freq.add_worker_state(worker_state)
+            tagged = iter(tagged)
+            for sentence, fingerprint, cached in pending.popleft():
+                fields = cached if cached else next(tagged)
+                if tag_cache:
+                    tag_cache.set(sentence.spa_id, fingerprint, *fields)
+                    if cached:
+                        tag_cache.reused += 1
+                    else:
+                        tag_cache.recomputed += 1
+                yield sentence, fields
 
-            sentence_tags = self.get_sentence_tags(sentence.spanish, tag_data)
-#            uniqueid = self.get_fingerprint(sentence_tags)
-#            if uniqueid in seen:
-#                continue
-#            seen.add(uniqueid)
+    @staticmethod
+    def iter_pool_results(pool, batches, max_pending):
+        """
+        Yields tag_batch() for every batch, in order, tagged by the pool workers
+        Unlike pool.imap, which reads every batch from the input before the results are consumed,
+        only max_pending batches are submitted to the pool at a time
+        """
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.apply_async(tag_batch, (batch,)))
+            if len(in_flight) >= max_pending:
+                yield in_flight.popleft().get()
+
+        while in_flight:
+            yield in_flight.popleft().get()
 
-            tag_str = " ".join(
-                [f":{tag}," + ",".join(items) for tag, items in sentence_tags.items()]
-            )
+    @staticmethod
+    def iter_batches(items, batch_size):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def tag_sentences(self, batch):
+        """ Returns (tag_str, verb_rank) for every (sentence, tag_data, include_verb_rank) in batch """
+        return [self.get_tagged_fields(sentence, tag_data, include_verb_rank) for sentence, tag_data, include_verb_rank in batch]
+
+    def get_tagged_fields(self, sentence, tag_data, include_verb_rank=False):
+        """ Returns (tag_str, verb_rank), verb_rank is None unless include_verb_rank is set """
+
+        sentence_tags = self.get_sentence_tags(sentence.spanish, tag_data)
+#        uniqueid = self.get_fingerprint(sentence_tags)
+#        if uniqueid in seen:
+#            continue
+#        seen.add(uniqueid)
+
+        tag_str = " ".join(
+            [f":{tag}," + ",".join(items) for tag, items in sentence_tags.items()]
+        )
 
-            items = [
-                sentence.english,
-                sentence.spanish,
-                sentence.credits,
-                sentence.eng_score,
-                sentence.spa_score,
-                tag_str]
+        verb_rank = self.get_verb_rank(tag_data) if include_verb_rank else None
+        return tag_str, verb_rank
+
+    @staticmethod
+    def format_tagged_sentence(sentence, tag_str, verb_rank, include_verb_rank=False):
+        """ Returns the print_tagged_data() output line for sentence """
 
-            if include_verb_rank:
-                items.append(self.get_verb_rank(tag_data))
+        items = [
+            sentence.english,
+            sentence.spanish,
+            sentence.credits,
+            sentence.eng_score,
+            sentence.spa_score,
+            tag_str]
 
-            print("\t".join(map(str, items)))
+        if include_verb_rank:
+            items.append(verb_rank)
 
+        return "\t".join(map(str, items))
 
     def get_fingerprint(self, sentence_tags):
         # ignore sentences with the same adj/adv/noun/verb lemma combination
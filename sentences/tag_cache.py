@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+
+import hashlib
+import json
+import os
+
+from spanish_tools.freq.lemma_cache import stat_files
+
+class TagCache():
+    """
+    Sidecar file with the sentence tags of a previous build_sentences run, used by
+    SentenceBuilder.print_tagged_data to only tag sentences that are new or have changed
+
+    Each sentence is stored by its Spanish sentence id with a fingerprint of the Spanish
+    text and its freeling token data (see get_fingerprint)
+
+    context_files are files that affect every sentence (dictionary, allforms, ngram data),
+    if any of them is modified, all of the previous tags are discarded (see stat_files)
+    """
+
+    # Increment when changes to SentenceBuilder would change the sentence tags
+    VERSION = 1
+
+    def __init__(self, filename, context_files=[]):
+        self.filename = filename
+        self.context = stat_files(context_files, f"TagCache {self.VERSION}")
+        self.previous = {}
+        self.current = {}
+        self.reused = 0
+        self.recomputed = 0
+
+        if os.path.exists(filename):
+            with open(filename) as infile:
+                data = json.load(infile)
+            if data.get("context") == self.context:
+                self.previous = data["sentences"]
+
+    @staticmethod
+    def get_fingerprint(spanish, tag_data):
+        h = hashlib.md5(spanish.encode())
+        # ijson may return numbers as Decimal
+        h.update(json.dumps(tag_data, sort_keys=True, ensure_ascii=False, default=str).encode())
+        return h.hexdigest()
+
+    def get(self, spa_id, fingerprint):
+        """ Returns the stored (tag_str, verb_rank) or None if the sentence is new or has changed """
+        item = self.previous.get(str(spa_id))
+        if not item or item[0] != fingerprint:
+            return None
+        return tuple(item[1:])
+
+    def set(self, spa_id, fingerprint, tag_str, verb_rank):
+        self.current[str(spa_id)] = (fingerprint, tag_str, verb_rank)
+
+    def save(self):
+        with open(self.filename, "w") as outfile:
+            json.dump({"context": self.context, "sentences": self.current}, outfile, ensure_ascii=False)
@@ -91,6 +91,52 @@ def test_get_phrases(builder):
             Phrase(form='a ver', lemma='a ver', start=10, end=16),
             Phrase(form='fuegos artificiales', lemma='fuego artificial', start=20, end=41)]
 
+def test_make_phrase_trie():
+
+    all_phrases = {
+        "alt_case": {"el hierro": ["El Hierro"]},
+        2: {"gracias a": "gracias a", "el hierro": "El Hierro"},
+        3: {"gracias a dios": "Gracias a Dios"},
+    }
+
+    trie = SentenceBuilder.make_phrase_trie(all_phrases)
+    assert trie["gracias"]["a"][None] == ("gracias a", "gracias a")
+    assert trie["gracias"]["a"]["dios"][None] == ("gracias a dios", "Gracias a Dios")
+    assert trie["el"]["hierro"] == {None: ("el hierro", "El Hierro")}
+    assert None not in trie["gracias"]
+
+def test_phrase_cache(allforms, freq, ngramdb, builder, tmp_path):
+
+    cache_filename = os.path.join(tmp_path, "phrases.json")
+    input_filename = os.path.join(tmp_path, "input")
+    with open(input_filename, "w") as outfile:
+        outfile.write("1")
+
+    cached = SentenceBuilder(allforms, freq, ngramdb, phrase_cache=cache_filename, phrase_inputs=[input_filename])
+    assert cached._all_phrases is None
+    assert cached.all_phrases == builder.all_phrases
+    assert os.path.exists(cache_filename)
+
+    # Loaded from the cache without building the table
+    cached = SentenceBuilder(allforms, freq, ngramdb, phrase_cache=cache_filename, phrase_inputs=[input_filename])
+    cached.make_all_phrases = None
+    assert cached.all_phrases == builder.all_phrases
+    assert cached.get_phrases("Gracias a Dios, por fin llegaron.") == builder.get_phrases("Gracias a Dios, por fin llegaron.")
+
+def test_tag_to_pos_memo(allforms, freq, ngramdb, builder):
+
+    memo_builder = SentenceBuilder(allforms, freq, ngramdb, tag_memo_size=10)
+    memo_builder._all_phrases = builder.all_phrases
+
+    tag = {"form": "perros", "lemma": "perro", "tag": "NCMP000", "ctag": "NC"}
+    res = memo_builder.tag_to_pos(tag, "perros", False)
+    assert res == builder.tag_to_pos(tag, "perros", False)
+    assert isinstance(res, tuple)
+
+    assert memo_builder.tag_to_pos(tag, "perros", False) is res
+    assert memo_builder.tag_memo.hits == 1
+    assert memo_builder.tag_to_pos(tag, "perros", True) != res
+
 def test_get_lemmas(ngprobs):
 
     assert ngprobs.get_preferred_case("dios") == "XX"
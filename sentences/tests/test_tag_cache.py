@@ -0,0 +1,30 @@
+import os
+
+from ..tag_cache import TagCache
+
+def test_tag_cache(tmp_path):
+
+    filename = os.path.join(tmp_path, "tags.json")
+    context_filename = os.path.join(tmp_path, "dictionary")
+    with open(context_filename, "w") as outfile:
+        outfile.write("1")
+
+    tag_data = [{"tokens": [{"begin": "0", "end": "4", "form": "Dios", "lemma": "dios", "tag": "NCMS000", "ctag": "NC"}]}]
+    fingerprint = TagCache.get_fingerprint("Dios.", tag_data)
+    assert fingerprint != TagCache.get_fingerprint("Dios!", tag_data)
+
+    tag_cache = TagCache(filename, [context_filename])
+    assert tag_cache.get(1, fingerprint) is None
+    tag_cache.set(1, fingerprint, ":n,dios", None)
+    tag_cache.save()
+
+    tag_cache = TagCache(filename, [context_filename])
+    assert tag_cache.get(1, fingerprint) == (":n,dios", None)
+    assert tag_cache.get(1, "changed") is None
+    assert tag_cache.get(2, fingerprint) is None
+
+    # Changing the context discards the stored tags
+    with open(context_filename, "w") as outfile:
+        outfile.write("2 changed")
+    tag_cache = TagCache(filename, [context_filename])
+    assert tag_cache.get(1, fingerprint) is None
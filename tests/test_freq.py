@@ -1,3 +1,6 @@
+import io
+import json
+import multiprocessing
 import os
 import pytest
 from pytest import fixture
@@ -6,7 +9,8 @@ from pytest import fixture
 from enwiktionary_wordlist.wordlist import Wordlist
 from enwiktionary_wordlist.all_forms import AllForms
 
-from ..freq import FrequencyList, NgramPosProbability
+from ..freq import FrequencyList, LemmaCache, NgramPosProbability, PhaseTimer, ResolvedLines, init_worker
+from ..freq.freq import FreqItem, LemmaUsage
 
 
 @fixture(scope="module")
@@ -90,6 +94,215 @@ count,spanish,pos,flags,usage
 """
 
 
+def make_freq(wordlist_data, ngfilename, ngcase):
+    wordlist = Wordlist(wordlist_data.splitlines())
+    allforms = AllForms.from_wordlist(wordlist)
+    return FrequencyList(wordlist, allforms, NgramPosProbability(ngfilename, ngcase))
+
+# Shared by the tests that resolve the list in other processes
+MULTIPROCESS_WORDLIST = """\
+rojo {adj-meta} :: {{es-adj|f=roja}}
+rojo {adj} :: red (colour)
+rojo {n-meta} :: {{es-noun|m}}
+rojo {m} :: red (colour)
+roja {n-meta} :: {{es-noun|f|m=rojo}}
+roja {f} :: Red (Communist)
+protector {n-meta} :: {{es-noun|m|f=+}}
+protector {m} :: protector
+"""
+
+MULTIPROCESS_FLIST = """\
+rojo\t100
+roja\t50
+rojos\t40
+rojas\t30
+protectores\t20
+protectoras\t10
+unknown\t5
+"""
+
+@fixture(scope="module")
+def ngprobs_files(request):
+    """ The ngprobs and ngcase filenames, for processes that load their own NgramPosProbability """
+    test_dir, _ = os.path.split(request.module.__file__)
+    return os.path.join(test_dir, "es-1-1950.ngprobs"), os.path.join(test_dir, "es-1-1950.ngcase")
+
+def test_parallel(ngprobs_files):
+
+    ngfilename, ngcase = ngprobs_files
+    freq = make_freq(MULTIPROCESS_WORDLIST, ngfilename, ngcase)
+    expected = list(freq.process(MULTIPROCESS_FLIST.splitlines()))
+
+    with multiprocessing.Pool(2, initializer=init_worker, initargs=(make_freq, MULTIPROCESS_WORDLIST, ngfilename, ngcase)) as pool:
+        assert list(freq.process(MULTIPROCESS_FLIST.splitlines(), pool=pool)) == expected
+
+def write_test_shard(ngfilename, ngcase, shard, num_shards, filename):
+    freq = make_freq(MULTIPROCESS_WORDLIST, ngfilename, ngcase)
+    with open(filename, "w") as outfile:
+        freq.write_shard(MULTIPROCESS_FLIST.splitlines(), shard, num_shards, outfile)
+
+def test_shards(ngprobs_files, tmp_path):
+
+    ngfilename, ngcase = ngprobs_files
+
+    # Each shard is written by a separate process, standing in for a separate machine
+    num_shards = 3
+    shard_files = [os.path.join(tmp_path, f"shard{i}.jsonl") for i in range(num_shards)]
+    processes = [multiprocessing.Process(target=write_test_shard,
+        args=(ngfilename, ngcase, i, num_shards, filename)) for i, filename in enumerate(shard_files)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    freq = make_freq(MULTIPROCESS_WORDLIST, ngfilename, ngcase)
+    assert list(freq.process_shards(shard_files)) == list(freq.process(MULTIPROCESS_FLIST.splitlines()))
+
+def test_trace(ngprobs):
+
+    wordlist_data = """\
+rojo {adj-meta} :: {{es-adj|f=roja}}
+rojo {adj} :: red (colour)
+"""
+
+    flist_data = """\
+rojo\t100
+roja\t50
+rojos\t40
+"""
+
+    wordlist = Wordlist(wordlist_data.splitlines())
+    allforms = AllForms.from_wordlist(wordlist)
+    trace_file = io.StringIO()
+    freq = FrequencyList(wordlist, allforms, ngprobs, debug_word=["roja", "rojos"], trace_file=trace_file)
+    list(freq.process(flist_data.splitlines()))
+
+    events = [json.loads(line) for line in trace_file.getvalue().splitlines()]
+    assert {e["form"] for e in events} == {"roja", "rojos"}
+    assert [e["seq"] for e in events] == list(range(1, len(events)+1))
+    assert freq.trace_count == len(events)
+
+def test_filter_names(ngprobs):
+
+    usage = LemmaUsage()
+    for count, form in [(5, "rosa"), (20, "Rosa"), (10, "rosas"), (30, "ROSA")]:
+        usage.add(count, form)
+    assert usage.count == 65
+    assert str(usage) == "30:ROSA|20:Rosa|10:rosas|5:rosa"
+
+    freq = FrequencyList(Wordlist([]), None, ngprobs)
+    items = {("rosa", "n"): FreqItem(usage.count, "rosa", "n", [], usage)}
+    freq.filter_names(items)
+
+    item = items[("rosa", "n")]
+    assert item.count == 15
+    assert str(item.usage) == "10:rosas|5:rosa"
+
+def test_prune(ngprobs):
+
+    wordlist_data = """\
+rojo {adj-meta} :: {{es-adj|f=roja}}
+rojo {adj} :: red (colour)
+protector {n-meta} :: {{es-noun|m|f=+}}
+protector {m} :: protector
+"""
+
+    flist_data = """\
+rojo\t100
+roja\t50
+rojos\t40
+protectores\t20
+protectoras\t10
+unknown\t5
+"""
+
+    wordlist = Wordlist(wordlist_data.splitlines())
+    allforms = AllForms.from_wordlist(wordlist)
+    freq = FrequencyList(wordlist, allforms, ngprobs)
+
+    lines = flist_data.splitlines()
+    kept = freq.prune_lines(enumerate(lines), 100)
+    assert [line for linenum, line in kept] == lines[:3]
+
+    for minuse in [1, 6, 30, 31, 190]:
+        assert list(freq.process(lines, minuse, prune=True)) == list(freq.process(lines, minuse))
+
+def test_incremental(ngprobs, tmp_path):
+
+    wordlist_data = """\
+rojo {adj-meta} :: {{es-adj|f=roja}}
+rojo {adj} :: red (colour)
+protector {n-meta} :: {{es-noun|m|f=+}}
+protector {m} :: protector
+"""
+
+    flist_data = """\
+rojo\t100
+roja\t50
+rojos\t40
+protectores\t20
+"""
+
+    filename = os.path.join(tmp_path, "resolved.json")
+
+    def run(wordlist_data, flist_data):
+        wordlist = Wordlist(wordlist_data.splitlines())
+        freq = FrequencyList(wordlist, AllForms.from_wordlist(wordlist), ngprobs)
+        expected = list(freq.process(flist_data.splitlines()))
+        resolved_lines = ResolvedLines(filename)
+        assert list(freq.process(flist_data.splitlines(), resolved_lines=resolved_lines)) == expected
+        resolved_lines.save()
+        return resolved_lines
+
+    resolved_lines = run(wordlist_data, flist_data)
+    assert (resolved_lines.reused, resolved_lines.recomputed) == (0, 4)
+
+    resolved_lines = run(wordlist_data, flist_data + "protectoras\t10\n")
+    assert (resolved_lines.reused, resolved_lines.recomputed) == (4, 1)
+
+    # Only the lines that depend on the changed entry are resolved again
+    wordlist_data += "rojo {n-meta} :: {{es-noun|m}}\nrojo {m} :: red (colour)\n"
+    resolved_lines = run(wordlist_data, flist_data + "protectoras\t10\n")
+    assert (resolved_lines.reused, resolved_lines.recomputed) == (2, 3)
+
+def test_resolved_lines_key():
+    # Lines without a count are resolved with a count based on their position
+    assert ResolvedLines.get_key(5, "rojo\t100\n") == "rojo\t100"
+    assert ResolvedLines.get_key(5, "rojo\n") == "5:rojo"
+    assert ResolvedLines.get_key(5, "rojo\t\tmods\n") == "5:rojo\t\tmods"
+
+def test_incremental_candidates(ngprobs, tmp_path):
+
+    wordlist_data = """\
+fooa {n-meta} :: {{es-noun|m|pl=foo}}
+fooa {m} :: thing
+foob {adj-meta} :: {{es-adj|pl=foo}}
+foob {adj} [archaic] :: other thing
+"""
+
+    flist_data = "foo\t100\n"
+    filename = os.path.join(tmp_path, "resolved.json")
+
+    def run(wordlist_data):
+        wordlist = Wordlist(wordlist_data.splitlines())
+        freq = FrequencyList(wordlist, AllForms.from_wordlist(wordlist), ngprobs)
+        expected = list(freq.process(flist_data.splitlines()))
+        resolved_lines = ResolvedLines(filename)
+        assert list(freq.process(flist_data.splitlines(), resolved_lines=resolved_lines)) == expected
+        resolved_lines.save()
+        return resolved_lines
+
+    resolved_lines = run(wordlist_data)
+    assert (resolved_lines.reused, resolved_lines.recomputed) == (0, 1)
+
+    resolved_lines = run(wordlist_data)
+    assert (resolved_lines.reused, resolved_lines.recomputed) == (1, 0)
+
+    # foob isn't chosen, but once it stops being archaic it becomes a candidate
+    resolved_lines = run(wordlist_data.replace(" [archaic]", ""))
+    assert (resolved_lines.reused, resolved_lines.recomputed) == (0, 1)
+
 def test_simple2(ngprobs):
 
     wordlist_data = """\
@@ -110,6 +323,41 @@ roja {f} :: Red (Communist)
     items = freq.get_preferred_lemmas("roja")
     assert freq.get_ranked_pos("roja", items) == [(None, 'adj', 1)]
 
+def test_lemma_cache(ngprobs, tmp_path):
+
+    wordlist_data = """\
+rojo {adj-meta} :: {{es-adj|f=roja}}
+rojo {adj} :: red (colour)
+rojo {n-meta} :: {{es-noun|m}}
+rojo {m} :: red (colour)
+roja {n-meta} :: {{es-noun|f|m=rojo}}
+roja {f} :: Red (Communist)
+"""
+
+    dictionary = os.path.join(tmp_path, "dictionary")
+    with open(dictionary, "w") as outfile:
+        outfile.write(wordlist_data)
+
+    wordlist = Wordlist(wordlist_data.splitlines())
+    allforms = AllForms.from_wordlist(wordlist)
+    uncached = FrequencyList(wordlist, allforms, ngprobs)
+
+    lemma_cache = LemmaCache(os.path.join(tmp_path, "lemmas.db"), [dictionary])
+    freq = FrequencyList(wordlist, allforms, ngprobs, lemma_cache=lemma_cache)
+
+    for form, pos in [("roja", None), ("rojas", None), ("rojas", "adj"), ("rojo", "n")]:
+        expected = uncached.get_preferred_lemmas(form, None, pos)
+        assert freq.get_preferred_lemmas(form, None, pos) == expected
+        assert lemma_cache.get(form, None, pos) is not None
+        assert freq.get_preferred_lemmas(form, None, pos) == expected
+
+    memo_freq = FrequencyList(wordlist, allforms, ngprobs, memo_size=2)
+    for form in ["roja", "roja", "rojas", "rojo", "roja"]:
+        assert memo_freq.get_preferred_lemmas(form) == uncached.get_preferred_lemmas(form)
+    assert memo_freq.lemma_memo.hits == 1
+    assert memo_freq.lemma_memo.misses == 4
+    assert memo_freq.lemma_memo.evictions == 2
+
 def test_filters(ngprobs):
 
     wordlist_data = """\
@@ -460,6 +708,27 @@ count,spanish,pos,flags,usage
 10,ver,v,,10:vete\
 """
 
+def test_profile_formtypes(ngprobs, tmp_path):
+
+    wordlist_data = """\
+ver {v-meta} :: {{es-verb}} {{es-conj}}
+ver {v} :: x
+"""
+
+    wordlist = Wordlist(wordlist_data.splitlines())
+    freq = FrequencyList(wordlist, AllForms.from_wordlist(wordlist), ngprobs)
+    profiler = PhaseTimer()
+    freq.enable_profiling(profiler)
+
+    assert list(freq.formtypes(["veo\t10", "ver\t5"]))
+
+    filename = tmp_path / "profile.json"
+    profiler.save(filename)
+    phases = json.loads(filename.read_text())["phases"]
+    assert phases["index_irregular_verbs"]["calls"] == 1
+    assert phases["get_word_irregularities"]["calls"] > 0
+    assert phases["is_irregular_form"]["calls"] > 0
+
 def test_veros(ngprobs):
 
     wordlist_data = """\
@@ -759,6 +1028,15 @@ pos: n
     assert freq.get_resolved_lemmas(next(wordlist.get_iwords("test9", "n")), None, None) == []
     assert freq.get_resolved_lemmas(next(wordlist.get_iwords("test9", "n")), None, None, max_depth=4) == [test1]
 
+    # Problems are collected when a word is first resolved
+    freq = FrequencyList(wordlist, allforms, ngprobs, form_of_diagnostics=True)
+    for word in ["test5", "test9", "test9"]:
+        freq.get_resolved_lemmas(next(wordlist.get_iwords(word, "n")), None, None)
+    assert freq.form_of_problems == [
+        "cycle: test5:n -> test6:n -> test5:n",
+        "too deep: test9:n -> test8:n -> test4:n -> test3:n -> test2:n",
+    ]
+
 
 def test_rare_lemma(ngprobs):
 
@@ -823,6 +1101,11 @@ ratos,n,rato\
     # Archaic words aren't lemmas
     assert freq.is_lemma(rato2) == False
 
+    assert freq.is_rare_lemma(rato2) == True
+    assert freq.is_primary_lemma(rato1) == True
+    assert freq.is_primary_lemma(rato2) == False
+    assert freq.lemma_flags[rato2] == FrequencyList.FLAG_RARE
+
     assert freq.get_preferred_lemmas("ratas") == [rata]
 
     flist_data = """\
@@ -0,0 +1,46 @@
+import os
+
+from ..freq import FreqDB
+from ..freq.freq import FreqItem, LemmaUsage
+
+def test_freq_db(tmp_path):
+
+    def make_item(count, word, pos, flags):
+        usage = LemmaUsage()
+        usage.add(count, word)
+        return FreqItem(count, word, pos, flags, usage)
+
+    items = [
+        make_item(100, "de", "prep", []),
+        make_item(50, "la", "art", []),
+        make_item(20, "abuela", "n", ["DUPLICATE"]),
+        make_item(10, "abuelo", "n", ["NOUSAGE", "DUPLICATE"]),
+        make_item(5, "zzz", "none", ["NOUSAGE"]),
+    ]
+
+    filename = os.path.join(tmp_path, "freq.db")
+    csv_filename = os.path.join(tmp_path, "freq.csv")
+    with open(csv_filename, "w") as outfile:
+        outfile.write("count,spanish,pos,flags,usage\n")
+
+    FreqDB.create(filename, items).close()
+    assert FreqDB.is_freq_db(filename)
+    assert not FreqDB.is_freq_db(csv_filename)
+
+    # Re-creating replaces the existing list
+    FreqDB.create(filename, items).close()
+
+    db = FreqDB(filename)
+    assert [row["spanish"] for row in db.iter_rows()] == ["de", "la"]
+    assert [row["spanish"] for row in db.iter_rows(["DUPLICATE"])] == ["de", "la", "abuela"]
+    assert [row["spanish"] for row in db.iter_rows(["DUPLICATE", "NOUSAGE"])] == ["de", "la", "abuela", "abuelo", "zzz"]
+
+    assert next(db.iter_rows()) == {"spanish": "de", "pos": "prep", "count": 100}
+
+    # With a limit the rows are queried in pages, readers can still go past the limit
+    all_rows = list(db.iter_rows(["DUPLICATE", "NOUSAGE"]))
+    for limit in [1, 2, 5, 10]:
+        assert list(db.iter_rows(["DUPLICATE", "NOUSAGE"], limit)) == all_rows
+    assert [row["spanish"] for row in db.iter_rows(["DUPLICATE"], 2)] == ["de", "la", "abuela"]
+    assert db.get_flags(db.get_flag_bits()["NOUSAGE"]) == ["NOUSAGE"]
+    db.close()
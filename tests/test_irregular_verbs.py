@@ -0,0 +1,37 @@
+import os
+import pytest
+
+from ..freq.irregular_verbs import IrregularVerbs
+
+def test_irregular_verbs(tmp_path):
+    dictionary = os.path.join(tmp_path, "dictionary")
+    filename = os.path.join(tmp_path, "irregular.json")
+
+    with open(dictionary, "w") as outfile:
+        outfile.write("test1")
+
+    items = [(True, frozenset([("pres_1s", "tengo"), ("pret_1s", "tuve")])), (False, frozenset())]
+
+    verbs = IrregularVerbs(filename, [dictionary])
+    assert verbs.get("tener") is None
+    verbs.set("tener", items)
+    assert "tener" in verbs
+    verbs.save()
+
+    # Stored values persist
+    verbs = IrregularVerbs(filename, [dictionary])
+    assert verbs.get("tener") == items
+    assert len(verbs) == 1
+
+    # Changing the inputs discards the table
+    with open(dictionary, "w") as outfile:
+        outfile.write("test2 changed")
+
+    verbs = IrregularVerbs(filename, [dictionary])
+    assert verbs.get("tener") is None
+
+    # Without a filename the table is only kept in memory
+    verbs = IrregularVerbs()
+    verbs.set("tener", items)
+    verbs.save()
+    assert verbs.get("tener") == items
@@ -0,0 +1,87 @@
+import os
+import pytest
+
+from ..freq.lemma_cache import LemmaCache, stat_files
+
+def test_lemma_cache(tmp_path):
+    dictionary = os.path.join(tmp_path, "dictionary")
+    cachefile = os.path.join(tmp_path, "lemmas.db")
+
+    with open(dictionary, "w") as outfile:
+        outfile.write("test1")
+
+    cache = LemmaCache(cachefile, [dictionary])
+    assert cache.get("rojas", None, None) is None
+    cache.set("rojas", None, None, [("rojo", "adj", 0)])
+    cache.set("rojas", None, "n", [])
+    assert cache.get("rojas", None, None) == [("rojo", "adj", 0)]
+    cache.close()
+
+    # Cached values persist
+    cache = LemmaCache(cachefile, [dictionary])
+    assert cache.get("rojas", None, None) == [("rojo", "adj", 0)]
+    assert cache.get("rojas", None, "n") == []
+    assert cache.get("rojas", "rojo", None) is None
+    cache.close()
+
+    # Changing the inputs clears the cache
+    with open(dictionary, "w") as outfile:
+        outfile.write("test2 changed")
+
+    cache = LemmaCache(cachefile, [dictionary])
+    assert cache.get("rojas", None, None) is None
+    cache.close()
+
+def test_read_only(tmp_path):
+    dictionary = os.path.join(tmp_path, "dictionary")
+    cachefile = os.path.join(tmp_path, "lemmas.db")
+
+    with open(dictionary, "w") as outfile:
+        outfile.write("test1")
+
+    writer = LemmaCache(cachefile, [dictionary])
+    writer.set("rojas", None, None, [("rojo", "adj", 0)])
+    writer.flush()
+
+    reader = LemmaCache(cachefile, [dictionary], read_only=True)
+    assert reader.get("rojas", None, None) == [("rojo", "adj", 0)]
+
+    # New items are never written by the reader, they're passed to the writer
+    reader.set("rojos", None, None, [("rojo", "adj", 0)])
+    reader.close()
+    assert writer.get("rojos", None, None) is None
+
+    reader = LemmaCache(cachefile, [dictionary], read_only=True)
+    reader.set("rojos", None, None, [("rojo", "adj", 0)])
+    writer.add_pending(reader.pop_pending())
+    assert reader.pop_pending() == []
+    writer.close()
+    reader.close()
+
+    cache = LemmaCache(cachefile, [dictionary])
+    assert cache.get("rojos", None, None) == [("rojo", "adj", 0)]
+    cache.close()
+
+    # A reader ignores items built from other inputs
+    with open(dictionary, "w") as outfile:
+        outfile.write("test2 changed")
+    reader = LemmaCache(cachefile, [dictionary], read_only=True)
+    assert reader.get("rojas", None, None) is None
+    reader.close()
+
+def test_stat_files(tmp_path):
+    dictionary = os.path.join(tmp_path, "dictionary")
+
+    with open(dictionary, "w") as outfile:
+        outfile.write("test1")
+
+    key = stat_files([dictionary], "salt")
+    assert stat_files([dictionary], "salt") == key
+    assert stat_files([dictionary], "other") != key
+
+    # Rewriting the file changes its mtime
+    stat = os.stat(dictionary)
+    with open(dictionary, "w") as outfile:
+        outfile.write("test2")
+    os.utime(dictionary, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert stat_files([dictionary], "salt") != key
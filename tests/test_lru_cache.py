@@ -0,0 +1,40 @@
+import pytest
+
+from ..freq.lru_cache import LRUCache
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    assert cache.get("a") is None
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is the least recently used item
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+    assert cache.get_stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "evictions": 1, "hit_rate": 0.75}
+    assert cache.format_stats("test") == "test: 3 hits, 1 misses (75.0% hit rate), 1 evictions, 2/2 entries"
+
+    with pytest.raises(ValueError):
+        LRUCache(0)
+
+def test_counters():
+    worker = LRUCache(1)
+    worker.get("a")
+    worker.set("a", 1)
+    worker.get("a")
+    worker.set("b", 2)
+
+    # The counters are reset after they're collected
+    counters = worker.pop_counters()
+    assert counters == (1, 1, 1)
+    assert worker.pop_counters() == (0, 0, 0)
+
+    cache = LRUCache(2)
+    cache.get("a")
+    cache.add_counters(counters)
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 2, 1)
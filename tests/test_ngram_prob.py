@@ -21,3 +21,102 @@ def test_simple(ngram_prob):
     assert int(3570503 * 0.1259) == 449526
 
     assert ngram_prob.get_usage_count("de", "v") == 714
+
+def test_data(ngram_prob):
+    assert ngram_prob.get_data("de") == (3570503, {'prep': 3546581, 'n': 514140, 'adv': 18758, 'determiner': 2607, 'conj': 1728, 'v': 812, 'adj': 84})
+    assert ngram_prob.get_data("xyz") == (None, {})
+
+    assert ngram_prob.get_preferred_pos("de") == "prep"
+    assert ngram_prob.get_preferred_pos("la") == "determiner"
+    assert ngram_prob.get_preferred_pos("xyz") is None
+
+    assert ngram_prob.get_usage_count("xyz") == 0
+    assert ngram_prob.get_usage_count("de", "pron") == 0
+
+def test_compiled(ngram_prob, tmp_path):
+    filename = os.path.join(tmp_path, "test.ngbin")
+    ngram_prob.save(filename)
+    compiled = NgramPosProbability(filename)
+
+    for word in ["de", "la", "hoy", "xyz"]:
+        assert compiled.get_data(word) == ngram_prob.get_data(word)
+        assert compiled.get_pos_probs(word) == ngram_prob.get_pos_probs(word)
+        assert compiled.get_preferred_pos(word) == ngram_prob.get_preferred_pos(word)
+        assert compiled.get_usage_count(word, "n") == ngram_prob.get_usage_count(word, "n")
+
+    assert compiled.get_usage_count("de") == 3570503
+    assert list(compiled._rows) == list(ngram_prob._rows)
+
+    with pytest.raises(ValueError, match="cannot save a compiled NgramPosProbability"):
+        compiled.save(os.path.join(tmp_path, "test2.ngbin"))
+
+def test_batch(ngram_prob):
+    words = ["de", "xyz", "la"]
+    pos_list = ["n", "v", None, "pron"]
+    counts = ngram_prob.get_usage_counts(words, pos_list)
+    assert list(counts) == [ngram_prob.get_usage_count(word, pos) for word in words for pos in pos_list]
+    assert list(counts[:4]) == [449526, 714, 3570503, 0]
+
+    probs = ngram_prob.get_pos_prob_matrix(["de", "xyz"])
+    num_pos = len(NgramPosProbability._all_pos)
+    assert len(probs) == 2*num_pos
+    assert {pos: probs[col] for col, pos in enumerate(NgramPosProbability._all_pos) if probs[col]} == \
+            {k: v for k, v in ngram_prob.get_pos_probs("de").items() if v}
+    assert not any(probs[num_pos:])
+
+def test_malformed_lines(tmp_path):
+    probfile = os.path.join(tmp_path, "test.ngprobs")
+    with open(probfile, "w") as outfile:
+        outfile.write("de\t5\tADP:5\nnotab\nblank\t\tNOUN:3\nla\t2\tDET:2\n")
+
+    ngram_prob = NgramPosProbability(probfile)
+    assert ngram_prob.get_usage_count("de") == 5
+    assert ngram_prob.get_usage_count("la") == 2
+    for word in ["notab", "blank"]:
+        assert ngram_prob.get_usage_count(word) == 0
+        assert ngram_prob.get_data(word) == (None, {})
+
+def test_large_counts(tmp_path):
+    probfile = os.path.join(tmp_path, "test.ngprobs")
+    with open(probfile, "w") as outfile:
+        outfile.write("de\t9000000000\tADP:3000000000; NOUN:5\n")
+
+    ngram_prob = NgramPosProbability(probfile)
+    compiled_file = os.path.join(tmp_path, "test.ngbin")
+    ngram_prob.save(compiled_file)
+
+    for ngp in [ngram_prob, NgramPosProbability(compiled_file)]:
+        assert ngp.get_usage_count("de") == 9000000000
+        assert ngp.get_usage_count("de", "prep") == 9000000000
+        assert ngp.get_pos_probs("de")["prep"] == 1.0
+
+    # Files compiled with 32-bit counts are rejected
+    with open(compiled_file, "r+b") as outfile:
+        outfile.write(b"NGPROBS\x02")
+    with pytest.raises(ValueError, match="compiled by an older version"):
+        NgramPosProbability(compiled_file)
+
+def test_preferred_case(tmp_path):
+    probfile = os.path.join(tmp_path, "test.ngprobs")
+    casefile = os.path.join(tmp_path, "test.ngcase")
+    with open(probfile, "w") as outfile:
+        outfile.write("París\t20\tNOUN:20\nparís\t10\tNOUN:10\nde\t5\tADP:5\nDe\t3\tADP:3\nA\t2\tNOUN:2\n")
+    with open(casefile, "w") as outfile:
+        outfile.write("París\t18\nparís\t2\n")
+
+    ngram_prob = NgramPosProbability(probfile, casefile)
+    compiled_file = os.path.join(tmp_path, "test.ngbin")
+    ngram_prob.save(compiled_file)
+
+    for ngp in [ngram_prob, NgramPosProbability(compiled_file)]:
+        assert ngp.get_preferred_case("parís") == "París"
+        assert ngp.get_preferred_case("PARÍS") == "París"
+        assert ngp.get_preferred_case("De") == "de"
+        assert ngp.get_preferred_case("a") == "a"
+        assert ngp.get_preferred_case("xyz") == "xyz"
+
+        assert ngp.get_case_prob("París") == 18
+        assert ngp.get_case_prob("de") == 0
+
+    with pytest.raises(ValueError):
+        NgramPosProbability(probfile).get_case_prob("de")
@@ -0,0 +1,26 @@
+from ..freq.phase_timer import PhaseTimer
+
+class Counter():
+    def add(self, x, y=1):
+        return x + y
+
+def test_phase_timer(tmp_path):
+    profiler = PhaseTimer()
+    counter = Counter()
+    profiler.wrap(counter, "add")
+    profiler.wrap(counter, "add", "outer")
+
+    assert counter.add(1) == 2
+    assert counter.add(1, y=2) == 3
+    profiler.count("forms", 5)
+    profiler.count("forms")
+
+    report = profiler.get_report()
+    assert report["phases"]["add"]["calls"] == 2
+    assert report["phases"]["outer"]["calls"] == 2
+    assert report["phases"]["outer"]["seconds"] >= report["phases"]["add"]["seconds"]
+    assert report["counters"] == {"forms": 6}
+
+    filename = tmp_path / "profile.json"
+    profiler.save(filename)
+    assert filename.read_text().startswith("{")
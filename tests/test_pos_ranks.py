@@ -0,0 +1,45 @@
+import os
+import pytest
+
+from enwiktionary_wordlist.wordlist import Wordlist
+from enwiktionary_wordlist.all_forms import AllForms
+
+from ..freq import FrequencyList, NgramPosProbability, PosRanks
+
+def test_pos_ranks(request, tmp_path):
+    test_dir, _ = os.path.split(request.module.__file__)
+    ngfilename = os.path.join(test_dir, "test_ngram_prob.wordlist")
+    ngprobs = NgramPosProbability(ngfilename, None)
+
+    wordlist_data = """\
+de {prep} :: of
+de {f} :: the letter d
+de {n-meta} :: {{es-noun|f}}
+la {art} :: the
+la {f} :: the musical note
+la {n-meta} :: {{es-noun|m}}
+"""
+
+    wordlist = Wordlist(wordlist_data.splitlines())
+    allforms = AllForms.from_wordlist(wordlist)
+
+    pos_ranks = PosRanks(input_files=[ngfilename])
+    pos_ranks.build(allforms, ngprobs)
+
+    filename = os.path.join(tmp_path, "posranks.tsv")
+    pos_ranks.save(filename)
+    pos_ranks = PosRanks(filename, [ngfilename])
+    assert len(pos_ranks) == 2
+
+    freq = FrequencyList(wordlist, allforms, ngprobs)
+    for form in ["de", "la"]:
+        lemmas = list(wordlist.get_iwords(form))
+        all_pos = freq.get_all_pos(lemmas)
+        assert pos_ranks.get(form, all_pos) == freq.get_ranked_pos(form, lemmas)
+
+    # Other parts of speech aren't in the table
+    assert pos_ranks.get("de", ["adv", "prep"]) is None
+    assert pos_ranks.get("xyz", ["adv", "prep"]) is None
+
+    # Tables built from other inputs are ignored
+    assert len(PosRanks(filename, [])) == 0